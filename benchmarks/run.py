@@ -0,0 +1,218 @@
+"""
+    Offline benchmarks of pyzenobase, run against a MockZenobaseServer.
+
+        python benchmarks/run.py [--quick] [--output FILE] [--compare FILE]
+
+    Results are saved as JSON (by default to benchmarks/results/{version}-{date}.json,
+    which isn't checked in) so that releases can be compared, --compare prints the change against an earlier
+    results file. Every benchmark is run a few times and the fastest run is kept.
+
+    The time taken by "import pyzenobase" is also measured (in fresh interpreters) and
+    the script exits with status 1 if it is over IMPORT_TIME_BUDGET.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import gzip
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pyzenobase import ZenobaseAPI, ZenobaseEvent, CompactZenobaseEvent, EventBatch, fmt_datetime, fmt_datetimes
+from pyzenobase.encoding import EventsBody, dumps
+from pyzenobase.mock_server import MockZenobaseServer
+from pyzenobase.dump import dump
+from pyzenobase.aggregate import aggregate
+
+
+
+def package_version():
+    """The installed version of pyzenobase, or the one in setup.py when run from an uninstalled checkout"""
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        # Python 3.7
+        pass
+    else:
+        try:
+            return version("pyzenobase")
+        except PackageNotFoundError:
+            pass
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "setup.py")) as f:
+        return re.search(r"version=['\"]([^'\"]+)['\"]", f.read()).group(1)
+
+
+VERSION = package_version()
+
+# Seconds "import pyzenobase" may take, documented in README
+IMPORT_TIME_BUDGET = 0.02
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+_benchmarks = []
+
+
+def benchmark(fn):
+    _benchmarks.append(fn)
+    return fn
+
+
+def best_of(fn, repeat):
+    """Seconds taken by the fastest of repeat calls to fn"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def _timestamps(n):
+    start = datetime(2016, 1, 1)
+    return [start + timedelta(minutes=i) for i in range(n)]
+
+
+def _events(n):
+    return [{"timestamp": fmt_datetime(ts, "UTC"), "tag": ["benchmark"], "count": i, "percentage": i % 100 / 1.0}
+            for i, ts in enumerate(_timestamps(n))]
+
+
+@benchmark
+def event_construction(n, repeat):
+    rows = [{"timestamp": ts, "tag": ["benchmark"], "count": i} for i, ts in enumerate(_timestamps(n))]
+    timestamps, counts = _timestamps(n), list(range(n))
+    return {
+        "ZenobaseEvent": best_of(lambda: [ZenobaseEvent(dict(row)) for row in rows], repeat),
+        "CompactZenobaseEvent": best_of(lambda: [CompactZenobaseEvent(dict(row)) for row in rows], repeat),
+        "EventBatch": best_of(lambda: list(EventBatch(timestamp=timestamps, timezone="UTC",
+                                                      tag="benchmark", count=counts)), repeat),
+    }
+
+
+@benchmark
+def datetime_formatting(n, repeat):
+    timestamps = _timestamps(n)
+    return {
+        "fmt_datetime": best_of(lambda: [fmt_datetime(ts, "Europe/Stockholm") for ts in timestamps], repeat),
+        "fmt_datetimes": best_of(lambda: fmt_datetimes(timestamps, "Europe/Stockholm"), repeat),
+    }
+
+
+@benchmark
+def json_encoding(n, repeat):
+    events = _events(n)
+    body = EventsBody(events, dumps=dumps).to_bytes()
+    return {
+        "json.dumps": best_of(lambda: json.dumps({"events": events}), repeat),
+        "EventsBody": best_of(lambda: EventsBody(events, dumps=dumps).to_bytes(), repeat),
+        "gzip": best_of(lambda: gzip.compress(body, 6), repeat),
+    }
+
+
+@benchmark
+def bulk_upload(n, repeat):
+    events = _events(n)
+    results = {}
+    with MockZenobaseServer(latency=0.005) as server:
+        with ZenobaseAPI("benchmark", "benchmark", host=server.url) as zapi:
+            for workers in (1, 4):
+                def upload():
+                    bucket = zapi.create_bucket("upload")
+                    zapi.create_events(bucket, events, batch_size=500, max_workers=workers)
+                    zapi.delete_bucket(bucket["@id"])
+                results["create_events (workers={})".format(workers)] = best_of(upload, repeat)
+    return results
+
+
+@benchmark
+def dump_throughput(n, repeat):
+    with MockZenobaseServer(latency=0.005) as server:
+        with ZenobaseAPI("benchmark", "benchmark", host=server.url) as zapi:
+            events = _events(n // 4)
+            for i in range(4):
+                zapi.create_events(zapi.create_bucket("dump{}".format(i)), events, batch_size=1000)
+            with tempfile.TemporaryDirectory() as output_dir:
+                return {"dump": best_of(lambda: dump(zapi, output_dir, username="benchmark", progress=False), repeat)}
+
+
+@benchmark
+def aggregation(n, repeat):
+    events = _events(n)
+    return {
+        "aggregate": best_of(lambda: aggregate(events, "percentage", by="day", percentiles=(50, 90)), repeat),
+        "aggregate (timezone)": best_of(lambda: aggregate(events, "percentage", by="day",
+                                                          timezone="Europe/Stockholm"), repeat),
+    }
+
+
+def import_times(repeat):
+    """Seconds taken by the fastest of repeat imports of pyzenobase (and of ZenobaseAPI) in new interpreters"""
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    results = {}
+    for name, statement in [("import pyzenobase", "import pyzenobase"),
+                            ("from pyzenobase import ZenobaseAPI", "from pyzenobase import ZenobaseAPI")]:
+        code = "import time; started = time.perf_counter(); {}; print(time.perf_counter() - started)".format(statement)
+        results["import: " + name] = {"seconds": min(
+            float(subprocess.check_output([sys.executable, "-c", code], cwd=root)) for _ in range(max(repeat, 5)))}
+    return results
+
+
+def run(n, repeat):
+    results = {}
+    for fn in _benchmarks:
+        print("{}...".format(fn.__name__), file=sys.stderr)
+        for name, seconds in fn(n, repeat).items():
+            results["{}: {}".format(fn.__name__, name)] = {"seconds": seconds, "events_per_second": n / seconds}
+    results.update(import_times(repeat))
+    return results
+
+
+def compare(results, previous):
+    for name, result in sorted(results.items()):
+        if name in previous:
+            change = previous[name]["seconds"] / result["seconds"]
+            print("{:<50} {:>10.4f}s {:>6.2f}x".format(name, result["seconds"], change))
+        else:
+            print("{:<50} {:>10.4f}s    new".format(name, result["seconds"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pyzenobase benchmarks against a local mock server")
+    parser.add_argument("--quick", action="store_true", help="Use fewer events and runs")
+    parser.add_argument("--events", type=int, default=None, help="Events per benchmark (default 20000)")
+    parser.add_argument("--output", default=None, help="Where to save the results as JSON")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare with")
+    args = parser.parse_args()
+
+    n = args.events or (2000 if args.quick else 20000)
+    results = run(n, repeat=1 if args.quick else 3)
+
+    output = args.output or os.path.join(RESULTS_DIR, "{}-{}.json".format(VERSION, datetime.now().strftime("%Y%m%d-%H%M%S")))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"version": VERSION, "date": datetime.now().isoformat(), "python": platform.python_version(),
+                   "events": n, "results": results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
+    else:
+        compare(results, {})
+    print("Saved results to {}".format(output), file=sys.stderr)
+
+    import_time = results["import: import pyzenobase"]["seconds"]
+    if import_time > IMPORT_TIME_BUDGET:
+        print("import pyzenobase took {:.1f} ms, over the budget of {:.0f} ms"
+              .format(import_time * 1000, IMPORT_TIME_BUDGET * 1000), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
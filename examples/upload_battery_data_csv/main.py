@@ -1,10 +1,9 @@
 #!/usr/bin/python3
 
-import csv
 import argparse
-from datetime import datetime
 
 import pyzenobase
+from pyzenobase.ingest import ColumnMapping, ingest_csv
     
 BUCKET_NAME = "Battery - PyZenobase"
 BUCKET_DESC = "Uploaded using PyZenobase (http://github.com/ErikBjare/PyZenobase)"
@@ -18,26 +17,13 @@ def upload_batterystats(filename, username, password, bucket_name=BUCKET_NAME, b
     bucket = zapi.create_or_get_bucket(bucket_name, description=bucket_desc)
     bucket_id = bucket["@id"]
 
-    events = []
-    with open(filename, newline="") as f:
-        reader = csv.reader(f)
-        header = next(reader)
-        for row in reader:
-            events.append({header[i]: row[i] for i in range(len(header))})
-
-    print("Read {} events".format(len(events)))
-    for event in events:
-        # Transform data
-        event["timestamp"] = pyzenobase.fmt_datetime(datetime.strptime(event.pop("datetime"), "%Y-%m-%d %H:%M:%S"), timezone="Europe/Stockholm")
-        event["tag"] = event.pop("status")
-        event["percentage"] = float(event.pop("level"))
-        event["temperature"] = {"@value": float(event.pop("temperature")), "unit": "C"}
-        event.pop("voltage")
-
-    print("Checking that events are valid...")
-    events = [pyzenobase.ZenobaseEvent(event) for event in events]
+    mapping = ColumnMapping(timestamp="datetime", timestamp_format="%Y-%m-%d %H:%M:%S",
+                            timezone="Europe/Stockholm",
+                            fields={"tag": "status", "percentage": "level", "temperature": ("temperature", "C")})
     print("Uploading...")
-    zapi.create_events(bucket_id, events)
+    # Reads, validates and uploads the file in chunks, all at the same time
+    results = ingest_csv(zapi, bucket_id, filename, mapping)
+    print("Uploaded {} events".format(sum(result.count for result in results)))
     zapi.close()
     print("Done!")
 
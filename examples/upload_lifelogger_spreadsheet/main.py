@@ -7,14 +7,14 @@
     Example spreadsheet will be available at a later date.
 """
 
-# TODO: Ability to only send updates (events with dates later than the latest in bucket)
-
 import time
 import datetime
 import re
 import pprint
 import argparse
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
 import gspread
 import json
@@ -24,13 +24,137 @@ from typing import Optional, List
 import pyzenobase
 
 
-def times_to_dt(d, times):
-    return list(map(lambda t: pyzenobase.fmt_datetime(datetime.datetime.combine(d, t)), times))
+# Compiled once, shared by all columns (and worker processes)
+r_time = re.compile(r"[0-9]{1,2}:[0-9]{2}")
+r_weight = re.compile(r"^[0-9]+\.?[0-9]*")
+r_unit = re.compile(r"mcg|ug|mg|g|ml|cl|dl|l")
+r_roa = re.compile(r"oral|insuff|subl|intranasal|subcut|buccal")
+r_alc_perc = re.compile(r"[0-9]+\.?[0-9]*%")
+
+
+# The same times and doses occur over and over in a sheet, so each distinct cell is only parsed once
+@lru_cache(maxsize=None)
+def parse_time_cell(time_cell):
+    """Returns (times, time_is_approximate, error), error is None unless no valid time was found"""
+    try:
+        times = tuple(datetime.time(int(hours), int(minutes))
+                      for hours, minutes in (t.split(":") for t in r_time.findall(time_cell)))
+        if len(times) < 1:
+            raise Exception("No valid times found")
+    except Exception as e:
+        return (datetime.time(hour=0, minute=0),), time_cell[0] == "~", e
+    return times, time_cell[0] == "~", None
+
+
+@lru_cache(maxsize=None)
+def parse_dose(dose_and_substance):
+    """
+        Returns a dict with the dose's field ("weight" or "volume"), value, unit, substance,
+        alc_perc and extra tags, or (property, exception) if it could not be parsed
+    """
+    tags = []
+    if dose_and_substance[:1] == "~":
+        dose_and_substance = dose_and_substance[1:]
+        tags.append("approximate_dose")
+    elif dose_and_substance[:1] == "?":
+        dose_and_substance = dose_and_substance.replace("?", "0")
+        tags.append("unknown_dose")
+
+    try:
+        weight_or_volume = float(r_weight.findall(dose_and_substance)[0])
+    except (ValueError, IndexError) as e:
+        return "weight_or_volume", e
+
+    try:
+        unit = r_unit.findall(dose_and_substance)[0]
+    except IndexError as e:
+        return "unit", e
+
+    alc_perc = None
+    if "%" in dose_and_substance:
+        try:
+            alc_perc = r_alc_perc.findall(dose_and_substance)[0].replace("%", "")
+        except IndexError as e:
+            return "percentage", e
+
+    try:
+        substance = dose_and_substance.split(" ")[1]
+    except IndexError as e:
+        return "substance", e
+
+    return {"field": "volume" if "l" in unit else "weight", "value": weight_or_volume, "unit": unit,
+            "substance": substance, "alc_perc": alc_perc, "tags": tags}
+
+
+def parse_timestamped_column(dates, time_cells, data_cells):
+    """
+        Parses one (time, data) column pair of the timestamped supplements sheet into
+        events, returns (events, parse_errors). A top-level function so that columns can
+        be parsed in separate processes.
+    """
+    parse_errors = 0
+    rows = []
+    for d, time_cell, data_cell in zip(dates, time_cells, data_cells):
+        if not time_cell:
+            # Cell empty
+            continue
+
+        times, time_is_approximate, e = parse_time_cell(time_cell)
+        time_is_unknown = e is not None
+        if time_is_unknown:
+            # Did not contain time
+            logging.warning(("Could not parse time '{}' for '{}' at '{}' (exception: {}), " +
+                             "tagging with unknown_time")
+                            .format(time_cell, data_cell, d, e))
+            parse_errors += 1
+
+        # Get the route of administration, if not specified assume oral
+        try:
+            last_token = data_cell.split(" ")[-1]
+            roa = r_roa.findall(last_token)[0]
+        except IndexError:
+            roa = "oral"
+
+        for dose_and_substance in map(str.strip, data_cell.split("+")):
+            dose = parse_dose(dose_and_substance)
+            if not isinstance(dose, dict):
+                logging.warning(("Could not parse {} for '{}' at '{} {}' (exception: {}))"
+                                 .format(dose[0], dose_and_substance, d, times, dose[1])))
+                parse_errors += 1
+                continue
+
+            tags = [dose["substance"], roa, "timestamped"]
+            if dose["alc_perc"]:
+                tags.append("alcohol")
+            tags += dose["tags"]
+            if time_is_unknown:
+                tags.append("unknown_time")
+            if time_is_approximate:
+                tags.append("approximate_time")
+            rows.append((d, times, dose, tags))
+
+    # Formats the distinct timestamps of the whole column at once
+    datetimes = list(dict.fromkeys((d, t) for d, times, _, _ in rows for t in times))
+    timestamps = dict(zip(datetimes, pyzenobase.fmt_datetimes([datetime.datetime.combine(d, t)
+                                                               for d, t in datetimes])))
+    events = []
+    for d, times, dose, tags in rows:
+        event = pyzenobase.ZenobaseEvent(
+                {"timestamp": [timestamps[d, t] for t in times],
+                 "tag": tags,
+                 dose["field"]: {
+                     "@value": dose["value"],
+                     "unit": dose["unit"]
+                }}, trusted=True)
+        if dose["alc_perc"]:
+            event["percentage"] = dose["alc_perc"]
+        events.append(event)
+    return events, parse_errors
 
 
 class Lifelogger_to_Zenobase():
     def __init__(self, google_oauth_json_path, zenobase_username, zenobase_password,
-                 streaks_bucket_name="Streaks", supplements_bucket_name="Supplements - New"):
+                 streaks_bucket_name="Streaks", supplements_bucket_name="Supplements - New", only_new=False):
         json_key = json.load(open(google_oauth_json_path))
         scope = ['https://spreadsheets.google.com/feeds']
 
@@ -38,14 +162,23 @@ class Lifelogger_to_Zenobase():
         self.gc = gspread.authorize(credentials)
         logging.info("Authorization with Google successful!")
 
-        self.zapi = pyzenobase.ZenobaseAPI(zenobase_username, zenobase_password)
+        # Only upload events newer than the latest already uploaded, the high-water marks
+        # are kept in a file so that later runs don't have to ask Zenobase for them.
+        # Daily and timestamped supplements share a bucket but are tagged differently,
+        # so each has a mark of its own (see _create_events).
+        self.only_new = only_new
+        sync_state = pyzenobase.SyncState("~/.lifelogger-zenobase-sync.json") if only_new else None
+        self.zapi = pyzenobase.ZenobaseAPI(zenobase_username, zenobase_password, sync_state=sync_state)
         self.ll = self.gc.open("Lifelogger")
         self.streaks_bucket = self.zapi.create_or_get_bucket(streaks_bucket_name)
         self.supplements_bucket = self.zapi.create_or_get_bucket(supplements_bucket_name)
 
-    def _create_events(self, bucket_id, events, debugging=False):
+    def _create_events(self, bucket_id, events, debugging=False, tag=None):
+        """tag separates the high-water marks of event streams sharing a bucket when only_new is set"""
         logging.info("Uploading {} events...".format(len(events)))
-        if not debugging:
+        if self.only_new:
+            self.zapi.sync_events(bucket_id, events, tag=tag)
+        elif not debugging:
             self.zapi.create_events(bucket_id, events)
         else:
             for event in events:
@@ -95,37 +228,23 @@ class Lifelogger_to_Zenobase():
         categories = raw_table[0]
         labels = raw_table[1]
         dates = self.get_dates(raw_table)
+        rows = raw_table[2:2+len(dates)]
 
-        def next_cat_col(i):
-            n = 1
-            while True:
-                if i+n > len(categories)-1:
-                    return i
-                if categories[i+n]:
-                    return i+n
-                n += 1
-
-        def get_category_labels(i):
-            end_col = next_cat_col(i)
-            return zip(range(i, end_col), labels[i:end_col])
-
-        def get_label_cells(category, label):
-            ci = categories.index(category)
-            i = labels.index(label, ci)
+        # A single pass over the columns, each label belongs to the nearest category to its left
+        table = {}
+        category = None
+        for i, label in enumerate(labels):
+            if i < len(categories) and categories[i]:
+                category = categories[i]
+                table[category] = {}
+            if category is None:
+                continue
             cells = {}
-            for j, d in enumerate(dates):
-                cell = raw_table[j+2][i]
+            for d, row in zip(dates, rows):
+                cell = row[i]
                 if cell and cell != "#VALUE!":
                     cells[d] = cell
-            return cells
-
-        table = {}
-        for i, cat in enumerate(categories):
-            if not cat:
-                continue
-            table[cat] = {}
-            for i, label in get_category_labels(i):
-                table[cat][label] = get_label_cells(cat, label)
+            table[category][label] = cells
 
         return table
 
@@ -137,17 +256,20 @@ class Lifelogger_to_Zenobase():
         table = self.get_main()
         bucket_id = self.streaks_bucket["@id"]
 
+        dates = sorted({d for cells in table["Streaks"].values() for d in cells})
+        timestamps = dict(zip(dates, pyzenobase.fmt_datetimes(dates, timezone="Europe/Stockholm")))
+        mapping = {"TRUE": 1, "FALSE": -1}
+
         events = []
         for label in table["Streaks"]:
             for d in table["Streaks"][label]:
                 val = table["Streaks"][label][d]
-                mapping = {"TRUE": 1, "FALSE": -1}
                 try:
                     state = mapping[val]
                 except KeyError:
                     logging.warning("could not detect state of '{}'".format(val))
                     continue
-                ts = pyzenobase.fmt_datetime(d, timezone="Europe/Stockholm")
+                ts = timestamps[d]
                 events.append(pyzenobase.ZenobaseEvent(
                         {"timestamp": ts,
                          "count": state,
@@ -159,6 +281,7 @@ class Lifelogger_to_Zenobase():
         raw_table = self.get_raw_table("D - Daily")
         labels = raw_table[0]
         dates = self.get_dates(raw_table)
+        timestamps = pyzenobase.fmt_datetimes(dates, timezone="Europe/Stockholm")
         bucket_id = self.supplements_bucket["@id"]
 
         events = []
@@ -177,136 +300,40 @@ class Lifelogger_to_Zenobase():
                     continue
 
                 events.append(pyzenobase.ZenobaseEvent(
-                        {"timestamp": pyzenobase.fmt_datetime(d, timezone="Europe/Stockholm"),
+                        {"timestamp": timestamps[j],
                          "tag": [label, "daily"],
                          "weight": {
                              "@value": weight,
                              "unit": "mg"
                          }}))
-        self._create_events(bucket_id, events)
+        self._create_events(bucket_id, events, tag="daily")
 
-    def create_timestamped_supps(self):
+    def create_timestamped_supps(self, processes=None):
+        """
+            Columns are parsed in parallel by processes worker processes (one per CPU by
+            default, 1 parses them in this process).
+        """
         # TODO: Support extra data in parens or clean up spreadsheet data with clearer syntax for parenthesis-data
         # TODO: Support substances with spaces (or change all such instances to no-space names)
-        # TODO: Build tags sequentially instead of having a bunch of if-statements at the end
-        # TODO: Extract attempts at data extraction since the try-except clauses are practically identical
         raw_table = self.get_raw_table("D - Timestamped")
         dates = self.get_dates(raw_table)
-        parse_errors = 0
+        rows = raw_table[1:1+len(dates)]
 
-        r_time = re.compile("[0-9]{1,2}:[0-9]{2}")
-        r_weight = re.compile("^[0-9]+\.?[0-9]*")
-        r_unit = re.compile("mcg|ug|mg|g|ml|cl|dl|l")
-        r_roa = re.compile("oral|insuff|subl|intranasal|subcut|buccal")
-        r_alc_perc = re.compile("[0-9]+\.?[0-9]*%")
-
-        events = []
-        for i in range(1, len(raw_table[0]), 2):
-            for j, d in enumerate(dates):
-                time_cell = raw_table[j+1][i]
-                data_cell = raw_table[j+1][i+1]
-
-                time_is_approximate = False
-                time_is_unknown = False
-
-                if time_cell:
-                    try:
-                        if time_cell[0] == "~":
-                            time_is_approximate = True
-                        times = list(map(lambda x: datetime.datetime.strptime(x, "%H:%M").time(),
-                                         r_time.findall(time_cell)))
-                        if len(times) < 1:
-                            raise Exception("No valid times found")
-                    except Exception as e:
-                        # Did not contain time
-                        logging.warning(("Could not parse time '{}' for '{}' at '{}' (exception: {}), " +
-                                         "tagging with unknown_time")
-                                        .format(time_cell, data_cell, d, e))
-                        parse_errors += 1
-                        times = [datetime.time(hour=0, minute=0)]
-                        time_is_unknown = True
-                else:
-                    # Cell empty
-                    continue
+        # Pairs of (time, data) columns
+        columns = [(dates, [row[i] for row in rows], [row[i+1] for row in rows])
+                   for i in range(1, len(raw_table[0]), 2)]
+        if processes == 1 or len(columns) < 2:
+            results = [parse_timestamped_column(*column) for column in columns]
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                results = list(executor.map(parse_timestamped_column, *zip(*columns)))
 
-                # Get the route of administration, if not specified assume oral
-                try:
-                    last_token = data_cell.split(" ")[-1]
-                    roa = r_roa.findall(last_token)[0]
-                except IndexError:
-                    roa = "oral"
-
-                for dose_and_substance in map(str.strip, data_cell.split("+")):
-                    dose_is_approximate = False
-                    dose_is_unknown = False
-
-                    if dose_and_substance[0] == "~":
-                        dose_and_substance = dose_and_substance[1:]
-                        dose_is_approximate = True
-                    elif dose_and_substance[0] == "?":
-                        dose_and_substance = dose_and_substance.replace("?", "0")
-                        dose_is_unknown = True
-
-                    def parse_failed_msg(parse_property, exception):
-                        logging.warning(("Could not parse {} for '{}' at '{} {}' (exception: {}))"
-                                         .format(parse_property, dose_and_substance, d, times, exception)))
-
-                    try:
-                        weight_or_volume = float(r_weight.findall(dose_and_substance)[0])
-                    except (ValueError, IndexError) as e:
-                        parse_failed_msg("weight_or_volume", e)
-                        parse_errors += 1
-                        continue
-
-                    try:
-                        unit = r_unit.findall(dose_and_substance)[0]
-                    except IndexError as e:
-                        parse_failed_msg("unit", e)
-                        parse_errors += 1
-                        continue
-
-                    alc_perc = None
-                    if "%" in dose_and_substance:
-                        try:
-                            alc_perc = r_alc_perc.findall(dose_and_substance)[0]
-                            alc_perc = alc_perc.replace("%", "")
-                        except IndexError as e:
-                            parse_failed_msg("percentage", e)
-                            parse_errors += 1
-                            continue
-
-                    substance = dose_and_substance.split(" ")[1]
-                    unit_is_weight_or_vol = "volume" if "l" in unit else "weight"
-
-                    event = pyzenobase.ZenobaseEvent(
-                            {"timestamp": times_to_dt(d, times),
-                             "tag": [substance, roa, "timestamped"],
-                             unit_is_weight_or_vol: {
-                                 "@value": weight_or_volume,
-                                 "unit": unit
-                            }})
-
-                    if alc_perc:
-                        event["percentage"] = alc_perc
-                        event["tag"].append("alcohol")
-
-                    if dose_is_unknown:
-                        event["tag"].append("unknown_dose")
-
-                    if dose_is_approximate:
-                        event["tag"].append("approximate_dose")
-
-                    if time_is_unknown:
-                        event["tag"].append("unknown_time")
-
-                    if time_is_approximate:
-                        event["tag"].append("approximate_time")
-
-                    events.append(event)
+        events = [event for column_events, _ in results for event in column_events]
+        parse_errors = sum(column_errors for _, column_errors in results)
 
         logging.warning("Parse errors: " + str(parse_errors))
         bucket_id = self.supplements_bucket["@id"]
-        self._create_events(bucket_id, events, debugging=False)
+        self._create_events(bucket_id, events, debugging=False, tag="timestamped")
 
     def close(self):
         self.zapi.close()
@@ -320,13 +347,18 @@ if __name__ == "__main__":
     parser.add_argument("google_oauth_json_file")
     parser.add_argument("zenobase_username")
     parser.add_argument("zenobase_password")
+    parser.add_argument("--only-new", action="store_true",
+                        help="Only upload events newer than the latest already in each bucket")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Number of processes parsing timestamped supplements (default: one per CPU)")
     args = parser.parse_args()
 
     create_streaks = input("Create streaks? (y/N): ") == "y"
     create_daily_supps = input("Create daily supplements? (y/N): ") == "y"
     create_timestamped_supps = input("Create timestamped supplements? (y/N): ") == "y"
 
-    l2z = Lifelogger_to_Zenobase(args.google_oauth_json_file, args.zenobase_username, args.zenobase_password)
+    l2z = Lifelogger_to_Zenobase(args.google_oauth_json_file, args.zenobase_username, args.zenobase_password,
+                                 only_new=args.only_new)
 
     try:
         if create_streaks:
@@ -334,6 +366,6 @@ if __name__ == "__main__":
         if create_daily_supps:
             l2z.create_daily_supps()
         if create_timestamped_supps:
-            l2z.create_timestamped_supps()
+            l2z.create_timestamped_supps(processes=args.processes)
     finally:
         l2z.close()
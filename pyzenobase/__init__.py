@@ -1,4 +1,47 @@
+import importlib
+
 from .util import *
+from .util import __all__ as _util_all
+
+from .zenobase_event import ZenobaseEvent, CompactZenobaseEvent
+
+# Everything else is imported on first use by __getattr__, so that "import pyzenobase" doesn't
+# pay for requests, aiohttp or NumPy when they aren't needed (see the import time budget in README)
+_LAZY_ATTRIBUTES = {
+    "EventBatch": "event_batch",
+    "SyncState": "sync",
+    "RetryPolicy": "retry",
+    "RateLimiter": "retry",
+    "DedupStore": "dedup",
+    "DedupIndex": "dedup",
+    "event_hash": "dedup",
+    "UploadJournal": "journal",
+    "TokenStore": "token_store",
+    "ZenobaseAPI": "zenobase_api",
+    "ZenobaseAPIError": "zenobase_api",
+    "BatchResult": "zenobase_api",
+    "BatchUploadError": "zenobase_api",
+    "DeleteResult": "zenobase_api",
+    "BulkDeleteError": "zenobase_api",
+    "AsyncZenobaseAPI": "async_zenobase_api",
+    "LocalStore": "store",
+    "Metrics": "metrics",
+    "RequestInfo": "metrics",
+    "ResponseCache": "cache",
+    "MemoryCache": "cache",
+    "DiskCache": "cache",
+}
+
+__all__ = _util_all + ["ZenobaseEvent", "CompactZenobaseEvent"] + list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module("." + _LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
 
-from .zenobase_event import ZenobaseEvent
-from .zenobase_api import ZenobaseAPI
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
@@ -0,0 +1,343 @@
+"""
+    Aggregation of events by tag and time period, such as the daily total weight of each
+    supplement or the hourly mean temperature of a sensor.
+
+        events = zapi.list_events(bucket_id)["events"]  # or LocalStore.events(...)
+        for row in aggregate(events, "weight", by="day", percentiles=(50, 90)):
+            print(row["tag"], row["period"], row["sum"], row["p90"])
+
+    Measures are converted to a common unit first (weight: g, volume: L, temperature: C,
+    duration: s). Events are extracted into columns once and the statistics are computed
+    over the whole columns with NumPy if it is installed, otherwise in pure Python.
+"""
+
+from operator import itemgetter
+from itertools import chain
+from datetime import datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from pyzenobase import fmt_datetime, parse_datetime
+from pyzenobase.util import _get_timezone
+
+MEASURES = ("weight", "volume", "temperature", "duration", "percentage", "count", "rating")
+
+BASE_UNITS = {"weight": "g", "volume": "L", "temperature": "C", "duration": "s"}
+
+# Factors converting each unit into the base unit of the measure
+_UNIT_FACTORS = {
+    "weight": {"ug": 1e-6, "mcg": 1e-6, "µg": 1e-6, "mg": 1e-3, "g": 1.0, "kg": 1e3,
+               "oz": 28.349523125, "lb": 453.59237},
+    "volume": {"mL": 1e-3, "cL": 1e-2, "dL": 1e-1, "L": 1.0, "ml": 1e-3, "cl": 1e-2, "dl": 1e-1, "l": 1.0,
+               "fl oz": 0.0295735295625, "gal": 3.785411784},
+    "duration": {"ms": 1e-3, "s": 1.0, "min": 60.0, "h": 3600.0, "d": 86400.0},
+}
+
+_PERIOD_SECONDS = {"hour": 3600, "day": 86400, "week": 7 * 86400}
+
+# The epoch was a Thursday, weeks are shifted by this much to start on Mondays
+_WEEK_SHIFT = 3 * 86400
+
+STATS = ("count", "sum", "mean", "min", "max")
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _unit_transform(measure, unit):
+    """(scale, shift) converting amounts of the measure in unit to its base unit"""
+    if unit is None:
+        return 1.0, 0.0
+    if measure == "temperature":
+        if unit == "F":
+            return 5 / 9, -32 * 5 / 9
+        if unit == "K":
+            return 1.0, -273.15
+        return 1.0, 0.0
+    if measure in _UNIT_FACTORS:
+        try:
+            return _UNIT_FACTORS[measure][unit], 0.0
+        except KeyError:
+            raise ValueError("Unknown {} unit: {}".format(measure, unit))
+    return 1.0, 0.0
+
+
+def _to_base_unit(measure, value):
+    if not isinstance(value, dict):
+        return float(value)
+    scale, shift = _unit_transform(measure, value.get("unit"))
+    return float(value["@value"]) * scale + shift
+
+
+def _wall_time(timestamp, timezone):
+    """Local time of a timestamp as "YYYY-MM-DDTHH:MM:SS", in timezone or the timestamp's own offset if None"""
+    if isinstance(timestamp, str) and timezone is None:
+        return timestamp[:19]
+    return fmt_datetime(timestamp if isinstance(timestamp, datetime) else parse_datetime(timestamp), timezone)[:19]
+
+
+def _iter_rows(events, measure, group_by_tag):
+    """
+        Yields (timestamp, values, tags) of the events that have the measure, where timestamp
+        is the first of the event's and values and tags are lists
+    """
+    for event in events:
+        if measure not in event or "timestamp" not in event:
+            continue
+        timestamp = event["timestamp"]
+        event_values = event[measure]
+        event_tags = event.get("tag") if group_by_tag else None
+        yield (timestamp[0] if isinstance(timestamp, list) else timestamp,
+               event_values if isinstance(event_values, list) else [event_values],
+               [event_tags] if event_tags is None or isinstance(event_tags, str) else event_tags or [None])
+
+
+def _to_columns_python(events, measure, timezone, group_by_tag):
+    wall_times, values, tags = [], [], []
+    for timestamp, event_values, event_tags in _iter_rows(events, measure, group_by_tag):
+        wall_time = _wall_time(timestamp, timezone)
+        for value in event_values:
+            value = _to_base_unit(measure, value)
+            for tag in event_tags:
+                wall_times.append(wall_time)
+                values.append(value)
+                tags.append(tag)
+    return [(datetime.fromisoformat(wall_time) - _EPOCH).total_seconds() for wall_time in wall_times], values, tags
+
+
+# Positions of the separators in "YYYY-MM-DDTHH:MM:SS.fff+HHMM"
+_SEPARATORS = {4: "-", 7: "-", 10: "T", 13: ":", 16: ":"}
+# Lengths of timestamps with and without milliseconds
+_LENGTH_MS, _LENGTH_S = 28, 24
+_WALL_LENGTH = 19
+
+
+def _parse_timestamps(timestamps):
+    """
+        Parses Zenobase timestamps into (wall_epochs, utc_offsets) arrays of seconds, where
+        wall_epochs are the local times in the timestamps' own offsets. Timestamps in the
+        format of fmt_datetime are parsed all at once with NumPy, any others one at a time.
+    """
+    n = len(timestamps)
+    wall_epochs, offsets = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+    valid = np.zeros(n, dtype=bool)
+    try:
+        chars = np.array(timestamps, dtype="S")
+    except UnicodeEncodeError:
+        chars = None
+    if chars is not None and n:
+        lengths = np.char.str_len(chars)
+        if chars.itemsize < _LENGTH_MS:
+            chars = chars.astype("S{}".format(_LENGTH_MS))
+        chars = chars.view(np.uint8).reshape(n, -1)
+        has_ms = lengths == _LENGTH_MS
+        offset_chars = np.where(has_ms[:, None], chars[:, 23:28], chars[:, 19:24]).astype(np.int64)
+        sign, offset_digits = offset_chars[:, 0], offset_chars[:, 1:] - ord("0")
+        valid = (lengths == _LENGTH_S) | (has_ms & (chars[:, 19] == ord(".")))
+        valid &= ((sign == ord("+")) | (sign == ord("-"))) & ((offset_digits >= 0) & (offset_digits <= 9)).all(axis=1)
+        for i, separator in _SEPARATORS.items():
+            valid &= chars[:, i] == ord(separator)
+
+        walls = np.ascontiguousarray(chars[:, :_WALL_LENGTH]).view("S{}".format(_WALL_LENGTH)).ravel()
+        try:
+            wall_epochs = np.where(valid, walls, b"1970-01-01T00:00:00").astype("datetime64[s]").astype(np.int64)
+        except ValueError:
+            # Some wall time is out of range (such as month 13), leave them all to parse_datetime
+            valid[:] = False
+        offsets = np.where(sign == ord("-"), -1, 1) * (offset_digits @ [36000, 3600, 600, 60])
+
+    for i in np.flatnonzero(~valid).tolist():
+        dt = parse_datetime(timestamps[i])
+        wall_epochs[i] = (dt.replace(tzinfo=None) - _EPOCH) // timedelta(seconds=1)
+        offsets[i] = dt.utcoffset() // timedelta(seconds=1)
+    return wall_epochs, offsets
+
+
+def _transitions(tz):
+    """
+        The UTC times (as epochs) at which the offset of a pytz timezone changes and the
+        offsets from then on, None if it has no such table (or pytz no longer keeps it in
+        the private attributes read here)
+    """
+    transitions = getattr(tz, "_utc_transition_times", None)
+    transition_info = getattr(tz, "_transition_info", None)
+    if transitions is None or transition_info is None:
+        return None
+    return (np.array(transitions, dtype="datetime64[s]").astype(np.int64),
+            np.array([offset // timedelta(seconds=1) for offset, _, _ in transition_info]))
+
+
+def _utc_offsets(utc_epochs, timezone):
+    """UTC offsets in seconds of the pytz timezone at each of utc_epochs"""
+    tz = _get_timezone(timezone)
+    static_offset = tz.utcoffset(None)
+    if static_offset is not None:
+        return np.full(len(utc_epochs), static_offset // timedelta(seconds=1), dtype=np.int64)
+    transitions = _transitions(tz)
+    if transitions is None:
+        # Converted one distinct time at a time through pytz's public interface instead
+        unique_epochs, inverse = np.unique(utc_epochs, return_inverse=True)
+        offsets = np.array([datetime.fromtimestamp(epoch, tz).utcoffset() // timedelta(seconds=1)
+                            for epoch in unique_epochs.tolist()], dtype=np.int64)
+        return offsets[inverse]
+    # The same lookup as pytz does for every datetime, done at once for all of them
+    transition_epochs, transition_offsets = transitions
+    return transition_offsets[np.searchsorted(transition_epochs, utc_epochs, side="right") - 1]
+
+
+def _repeat(items, counts):
+    return [item for item, n in zip(items, counts) for _ in range(n)]
+
+
+def _to_columns_numpy(events, measure, timezone, group_by_tag):
+    # Columns are pulled out of the events in one quick pass each and only normalized
+    # item by item where they hold lists or datetimes
+    events = [event for event in events if measure in event and "timestamp" in event]
+    timestamps = list(map(itemgetter("timestamp"), events))
+    values = list(map(itemgetter(measure), events))
+    tags = [event.get("tag") for event in events] if group_by_tag else [None] * len(events)
+
+    if set(map(type, timestamps)) - {str}:
+        timestamps = [timestamp[0] if isinstance(timestamp, list) else timestamp for timestamp in timestamps]
+        timestamps = [timestamp if isinstance(timestamp, str) else fmt_datetime(timestamp, timezone)
+                      for timestamp in timestamps]
+    wall_epochs, offsets = _parse_timestamps(timestamps)
+    if timezone is not None:
+        utc_epochs = wall_epochs - offsets
+        wall_epochs = utc_epochs + _utc_offsets(utc_epochs, timezone)
+
+    value_types = set(map(type, values))
+    if list in value_types:
+        value_counts = [len(value) if isinstance(value, list) else 1 for value in values]
+        wall_epochs, tags = np.repeat(wall_epochs, value_counts), _repeat(tags, value_counts)
+        values = list(chain.from_iterable(value if isinstance(value, list) else [value] for value in values))
+        value_types = set(map(type, values))
+    if all(issubclass(value_type, dict) for value_type in value_types):
+        amounts, units = list(map(itemgetter("@value"), values)), [value.get("unit") for value in values]
+    elif not any(issubclass(value_type, dict) for value_type in value_types):
+        amounts, units = values, None
+    else:
+        amounts = [value["@value"] if isinstance(value, dict) else value for value in values]
+        units = [value.get("unit") if isinstance(value, dict) else None for value in values]
+
+    values = np.array(amounts, dtype=float)
+    if units is not None:
+        # Each distinct unit is converted once, for all the values in it at the same time
+        unit_column = np.array(units, dtype=object)
+        scales, shifts = np.ones(len(values)), np.zeros(len(values))
+        for unit in set(units):
+            matches = unit_column == unit
+            scales[matches], shifts[matches] = _unit_transform(measure, unit)
+        values = values * scales + shifts
+
+    if set(map(type, tags)) - {str, type(None)}:
+        tags = [[tag] if tag is None or isinstance(tag, str) else tag or [None] for tag in tags]
+        tag_counts = list(map(len, tags))
+        return np.repeat(wall_epochs, tag_counts), np.repeat(values, tag_counts), list(chain.from_iterable(tags))
+    return wall_epochs, values, tags
+
+
+def to_columns(events, measure, timezone=None, group_by_tag=True):
+    """
+        Extracts (local_epochs, values, tags) columns for the events that have the measure.
+        An event is counted once for each of its tags (or under the tag None if it has none,
+        or if group_by_tag is False).
+    """
+    if np is None:
+        return _to_columns_python(events, measure, timezone, group_by_tag)
+    return _to_columns_numpy(events, measure, timezone, group_by_tag)
+
+
+def _period_starts(epochs, by):
+    """Start of the period (as local epoch seconds) each epoch falls in"""
+    seconds = _PERIOD_SECONDS[by]
+    shift = _WEEK_SHIFT if by == "week" else 0
+    if np is not None:
+        return (np.asarray(epochs) + shift) // seconds * seconds - shift
+    return [int((epoch + shift) // seconds * seconds - shift) for epoch in epochs]
+
+
+def _percentile(sorted_values, q):
+    """Percentile with linear interpolation, the same as numpy.percentile's default"""
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _aggregate_python(epochs, values, tags, by, stats, percentiles):
+    groups = {}
+    for tag, period, value in zip(tags, _period_starts(epochs, by), values):
+        groups.setdefault((tag, period), []).append(value)
+
+    rows = []
+    for (tag, period), group in groups.items():
+        row = {"count": len(group), "sum": sum(group), "min": min(group), "max": max(group)}
+        row["mean"] = row["sum"] / row["count"]
+        row = {stat: row[stat] for stat in stats}
+        if percentiles:
+            group.sort()
+            for q in percentiles:
+                row["p{:g}".format(q)] = _percentile(group, q)
+        rows.append((tag, period, row))
+    return rows
+
+
+def _aggregate_numpy(epochs, values, tags, by, stats, percentiles):
+    values = np.asarray(values, dtype=float)
+    periods = _period_starts(epochs, by)
+    unique_tags = list(set(tags))
+    tag_codes = {tag: code for code, tag in enumerate(unique_tags)}
+    codes = np.fromiter(map(tag_codes.__getitem__, tags), dtype=np.int64, count=len(tags))
+
+    # Sort by group and then value, so each group is a contiguous, sorted slice
+    order = np.lexsort((values, periods, codes))
+    codes, periods, values = codes[order], periods[order], values[order]
+    boundaries = np.flatnonzero((np.diff(codes) != 0) | (np.diff(periods) != 0)) + 1
+    starts = np.concatenate(([0], boundaries))
+    counts = np.diff(np.concatenate((starts, [len(values)])))
+
+    columns = {"count": counts,
+               "sum": np.add.reduceat(values, starts),
+               "min": values[starts],
+               "max": values[starts + counts - 1]}
+    columns["mean"] = columns["sum"] / counts
+    for q in percentiles:
+        position = starts + (counts - 1) * q / 100
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, starts + counts - 1)
+        columns["p{:g}".format(q)] = values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+    names = list(stats) + ["p{:g}".format(q) for q in percentiles]
+    columns = {name: columns[name].tolist() for name in names}
+    return [(unique_tags[code], period, {name: columns[name][i] for name in names})
+            for i, (code, period) in enumerate(zip(codes[starts].tolist(), periods[starts].tolist()))]
+
+
+def aggregate(events, measure, by="day", stats=STATS, percentiles=(), timezone=None, group_by_tag=True):
+    """
+        Groups events by tag and period (hour, day or week, weeks start on Mondays) and
+        computes stats (any of count, sum, mean, min and max) and percentiles (0-100) of the
+        measure within each group.
+
+        Periods are in local time: of timezone if given, otherwise of each event's timestamp.
+        Returns a list of dicts with the keys tag, period (a naive datetime of the start of
+        the period), the stats and p{q} for each percentile, sorted by tag and period.
+    """
+    if measure not in MEASURES:
+        raise ValueError("measure must be one of {}".format(", ".join(MEASURES)))
+    if by not in _PERIOD_SECONDS:
+        raise ValueError("by must be one of {}".format(", ".join(_PERIOD_SECONDS)))
+    invalid_stats = set(stats) - set(STATS)
+    if invalid_stats:
+        raise ValueError("Invalid stats: {}".format(invalid_stats))
+
+    epochs, values, tags = to_columns(events, measure, timezone=timezone, group_by_tag=group_by_tag)
+    if not len(values):
+        return []
+    aggregate_groups = _aggregate_numpy if np is not None else _aggregate_python
+    rows = aggregate_groups(epochs, values, tags, by, stats, percentiles)
+    rows.sort(key=lambda row: (row[0] is not None, row[0] or "", row[1]))
+    return [dict(tag=tag, period=_EPOCH + timedelta(seconds=period), **row) for tag, period, row in rows]
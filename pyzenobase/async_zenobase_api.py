@@ -0,0 +1,271 @@
+import json
+import time
+import asyncio
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from pyzenobase import CompactZenobaseEvent, iter_batches
+from pyzenobase.encoding import dumps, EventsBody, EVENTS_PREFIX, EVENTS_SUFFIX, EVENTS_SEPARATOR
+from pyzenobase.retry import RetryPolicy
+from pyzenobase.zenobase_api import ZenobaseAPI, ZenobaseAPIError, BatchResult, BatchUploadError
+
+
+class AsyncZenobaseAPI:
+    """
+        asyncio version of ZenobaseAPI, requires aiohttp.
+
+        All methods are coroutines, at most max_concurrency requests are in flight at once
+        no matter how many coroutines are run concurrently (with asyncio.gather for example).
+
+            async with AsyncZenobaseAPI(username, password) as zapi:
+                buckets = (await zapi.list_buckets())["buckets"]
+                results = await asyncio.gather(*[zapi.list_events(b["@id"]) for b in buckets])
+
+        Failed requests are retried according to retry (RetryPolicy() by default) and a
+        request getting a 401 logs in again once, like with ZenobaseAPI. Non-2xx responses
+        raise ZenobaseAPIError. Rate limiting, caching, token stores and observers are only
+        supported by ZenobaseAPI.
+    """
+
+    HOST = ZenobaseAPI.HOST
+
+    def __init__(self, username=None, password=None, session=None, pool_size=10, max_concurrency=10, timeout=60,
+                 bucket_cache_ttl=300, retry=None, host=None):
+        if aiohttp is None:
+            raise ImportError("AsyncZenobaseAPI requires aiohttp to be installed")
+        self._username = username
+        self._password = password
+        self._owns_session = session is None
+        self.session = session
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.retry = retry if retry is not None else RetryPolicy()
+        if host is not None:
+            self.HOST = host.rstrip("/")
+        # Same label->bucket index as ZenobaseAPI's
+        self.bucket_cache_ttl = bucket_cache_ttl
+        self._buckets_by_label = None
+        self._bucket_index_built_at = 0
+        self._bucket_index_lock = asyncio.Lock()
+        self.access_token = None
+        self.client_id = None
+        self._auth_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.authenticate()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def authenticate(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size),
+                                                 timeout=aiohttp.ClientTimeout(total=self.timeout))
+        await self._authenticate(rejected_token=self.access_token)
+
+    async def _authenticate(self, rejected_token=None):
+        """Logs in, unless another coroutine has already replaced rejected_token meanwhile"""
+        async with self._auth_lock:
+            if self.access_token != rejected_token:
+                return
+            if self._username is not None:
+                payload = {"grant_type": "password", "username": self._username, "password": self._password}
+            else:
+                payload = {"grant_type": "client_credentials"}
+            data = await self._send_attempts("POST", self.HOST + "/oauth/token", {"data": payload, "headers": {}},
+                                             idempotent=True)
+            data = json.loads(data) if isinstance(data, str) else data
+            if "error" in data:
+                raise Exception("Invalid Zenobase credentials")
+            self.access_token = data["access_token"]
+            self.client_id = data["client_id"]
+
+    async def _request(self, method, endpoint, data=None, headers=None, body=None):
+        """If body is given it is sent as-is (already encoded JSON) instead of data"""
+        if self.access_token is None:
+            await self.authenticate()
+        url = self.HOST + endpoint
+        token = self.access_token
+        headers = dict(headers) if headers else {}
+        headers["Authorization"] = "Bearer {}".format(token)
+        headers["Content-Type"] = "application/json"
+        body = dumps(data) if body is None else body
+        async with self._semaphore:
+            return await self._send_attempts(method, url, {"data": body, "headers": headers}, token=token)
+
+    async def _send_attempts(self, method, url, kwargs, idempotent=False, token=None):
+        """
+            Sends the request as many times as the retry policy allows and returns the decoded
+            body of the first 2xx response. Requests carrying a token are sent once more with
+            a new token if they get a 401.
+        """
+        attempt = 0
+        reauthenticated = token is None
+        while True:
+            try:
+                async with self.session.request(method, url, **kwargs) as r:
+                    if 200 <= r.status < 300:
+                        if "application/json" in r.headers.get("content-type", ""):
+                            return await r.json()
+                        return await r.text()
+                    retry_after = RetryPolicy.parse_retry_after(r.headers.get("Retry-After"))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if not self.retry.should_retry(method, attempt, idempotent=idempotent):
+                    raise
+                await asyncio.sleep(self.retry.backoff(attempt))
+                attempt += 1
+                continue
+
+            if r.status == 401 and not reauthenticated:
+                # Concurrent requests rejected with the same token all reuse the first replacement
+                await self._authenticate(rejected_token=token)
+                token = self.access_token
+                kwargs["headers"]["Authorization"] = "Bearer {}".format(token)
+                reauthenticated = True
+                continue
+            if not self.retry.should_retry(method, attempt, r.status, idempotent=idempotent):
+                raise ZenobaseAPIError(r)
+            await asyncio.sleep(self.retry.backoff(attempt, retry_after))
+            attempt += 1
+
+    async def _get(self, *args, **kwargs):
+        return await self._request("GET", *args, **kwargs)
+
+    async def _post(self, *args, **kwargs):
+        return await self._request("POST", *args, **kwargs)
+
+    async def _delete(self, *args, **kwargs):
+        return await self._request("DELETE", *args, **kwargs)
+
+    async def _iter_bucket_pages(self, offset=0, limit=None, page_size=100):
+        while limit is None or limit > 0:
+            page_limit = page_size if limit is None else min(page_size, limit)
+            page = await self._get("/users/{}/buckets/?order=label&offset={}&limit={}"
+                                   .format(self.client_id, offset, page_limit))
+            yield page
+            offset += len(page["buckets"])
+            if limit is not None:
+                limit -= len(page["buckets"])
+            if len(page["buckets"]) < page_limit or offset >= page.get("total", offset + 1):
+                break
+
+    async def list_buckets(self, offset=0, limit=100):
+        """Same as ZenobaseAPI.list_buckets, limits above 100 (or None) are fetched in pages"""
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be at least 1 (or None for all buckets)")
+        data = None
+        async for page in self._iter_bucket_pages(offset, limit):
+            if data is None:
+                data = page
+            else:
+                data["buckets"].extend(page["buckets"])
+        return data
+
+    async def iter_buckets(self, page_size=100):
+        """Async generator of all buckets ordered by label, fetched page_size at a time"""
+        async for page in self._iter_bucket_pages(page_size=page_size):
+            for bucket in page["buckets"]:
+                yield bucket
+
+    async def get_bucket(self, bucket_id):
+        return await self._get("/buckets/{}".format(bucket_id))
+
+    async def _bucket_index(self):
+        """Returns the label->bucket index, rebuilding it if it is older than bucket_cache_ttl"""
+        if self._buckets_by_label is None or \
+                time.monotonic() - self._bucket_index_built_at > self.bucket_cache_ttl:
+            buckets_by_label = {}
+            async for bucket in self.iter_buckets():
+                buckets_by_label.setdefault(bucket["label"], bucket)
+            self._buckets_by_label = buckets_by_label
+            self._bucket_index_built_at = time.monotonic()
+        return self._buckets_by_label
+
+    def invalidate_bucket_index(self):
+        self._buckets_by_label = None
+
+    async def create_bucket(self, label, description=""):
+        if not 1 <= len(label) <= 20:
+            raise Exception("Bucket name must be 1-20 chars and can only contain [a-zA-Z0-9-_ ]")
+        bucket = await self._post("/buckets/", data={"label": label, "description": description})
+        if self._buckets_by_label is not None and isinstance(bucket, dict):
+            self._buckets_by_label.setdefault(bucket.get("label", label), bucket)
+        return bucket
+
+    async def create_or_get_bucket(self, label, description=""):
+        """
+            Looks the label up in the bucket index, concurrent calls wait for each other so
+            that a label is only created once
+        """
+        async with self._bucket_index_lock:
+            bucket = (await self._bucket_index()).get(label)
+            if bucket is None:
+                bucket = await self.create_bucket(label, description=description)
+            return bucket
+
+    async def delete_bucket(self, bucket_id):
+        await self._delete("/buckets/{}".format(bucket_id))
+        if self._buckets_by_label is not None:
+            self._buckets_by_label = {label: bucket for label, bucket in self._buckets_by_label.items()
+                                      if bucket["@id"] != bucket_id}
+
+    async def list_events(self, bucket_id):
+        return await self._get("/buckets/{}/".format(bucket_id))
+
+    async def create_event(self, bucket_or_bucket_id, event):
+        assert isinstance(event, dict) or isinstance(event, CompactZenobaseEvent)
+        bucket_id = ZenobaseAPI._bucket_id_from_bucket_or_id(bucket_or_bucket_id)
+        return await self._post("/buckets/{}/".format(bucket_id), data=event)
+
+    async def create_events(self, bucket_or_bucket_id, events, batch_size=1000, max_bytes=None,
+                            raise_on_error=True):
+        """Same as ZenobaseAPI.create_events, batches are sent concurrently up to max_concurrency"""
+        bucket_id = ZenobaseAPI._bucket_id_from_bucket_or_id(bucket_or_bucket_id)
+        endpoint = "/buckets/"+bucket_id+"/"
+
+        def encode(events):
+            for event in events:
+                assert isinstance(event, dict) or isinstance(event, CompactZenobaseEvent)
+                yield dumps(event)
+
+        async def upload(index, batch):
+            try:
+                response = await self._post(endpoint, body=EventsBody(batch).to_bytes())
+                return BatchResult(index, len(batch), response, None)
+            except Exception as e:
+                return BatchResult(index, len(batch), None, e)
+
+        if max_bytes is not None:
+            max_bytes -= len(EVENTS_PREFIX) + len(EVENTS_SUFFIX)
+        batches = iter_batches(encode(events), batch_size=batch_size, max_bytes=max_bytes,
+                               size=lambda encoded_event: len(encoded_event) + len(EVENTS_SEPARATOR))
+
+        # Only keep max_concurrency batches encoded and in flight at a time
+        results, pending = [], set()
+        for index, batch in enumerate(batches):
+            if len(pending) >= self.max_concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                results.extend(task.result() for task in done)
+            pending.add(asyncio.ensure_future(upload(index, batch)))
+        if pending:
+            done, _ = await asyncio.wait(pending)
+            results.extend(task.result() for task in done)
+        results.sort(key=lambda result: result.index)
+
+        if raise_on_error and any(result.error is not None for result in results):
+            raise BatchUploadError(results)
+        return results
+
+    async def close(self):
+        try:
+            if self.access_token is not None:
+                return await self._delete("/authorizations/"+self.access_token)
+        finally:
+            if self._owns_session and self.session is not None:
+                await self.session.close()
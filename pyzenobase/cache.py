@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from urllib.parse import quote
+
+
+class ResponseCache(ABC):
+    """
+        Base class of the caches of GET responses that ZenobaseAPI(cache=...) can use.
+
+        Responses with an ETag or Last-Modified header are revalidated with a conditional
+        request every time they are used (which is cheap if they haven't changed), other
+        responses are used without asking the server for ttl seconds.
+
+        Entries are dicts with the keys content (the response body as text), is_json,
+        etag, last_modified and stored_at.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def is_fresh(self, entry):
+        """Whether an entry can be used without making a request"""
+        return entry["etag"] is None and entry["last_modified"] is None and \
+            time.time() - entry["stored_at"] < self.ttl
+
+    @abstractmethod
+    def get(self, key):
+        """Returns the entry stored under key, None if there is none"""
+
+    @abstractmethod
+    def set(self, key, entry):
+        """Stores entry under key, replacing any entry already stored under it"""
+
+    @abstractmethod
+    def invalidate(self, prefixes=(), keys=()):
+        """Removes the entries with any of the keys and all entries whose key starts with any of the prefixes"""
+
+    @staticmethod
+    def _matches(key, prefixes, keys):
+        return key in keys or key.startswith(tuple(prefixes))
+
+    def clear(self):
+        self.invalidate(prefixes=[""])
+
+
+class MemoryCache(ResponseCache):
+    """Keeps up to max_entries responses in memory, evicting the least recently used"""
+
+    def __init__(self, max_entries=256, ttl=60):
+        super(MemoryCache, self).__init__(ttl=ttl)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, prefixes=(), keys=()):
+        with self._lock:
+            for key in [key for key in self._entries if self._matches(key, prefixes, keys)]:
+                del self._entries[key]
+
+
+class DiskCache(ResponseCache):
+    """
+        Keeps responses as one JSON file each in directory, so they persist between runs.
+        Files are named after their (quoted) keys so that entries can be invalidated by
+        listing the directory, without opening any file.
+    """
+
+    # Longer quoted keys are cut to this length and get a hash of the whole key appended, which
+    # keeps names (and those of their temporary files) within the usual limit of 255 bytes
+    MAX_NAME_LENGTH = 160
+
+    def __init__(self, directory, ttl=60):
+        super(DiskCache, self).__init__(ttl=ttl)
+        self.directory = os.path.expanduser(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _filename(self, key):
+        # quote escapes "#", so it only appears in names as the separator of the hash
+        name = quote(key, safe="")
+        if len(name) > self.MAX_NAME_LENGTH:
+            name = "{}#{}".format(name[:self.MAX_NAME_LENGTH], hashlib.sha1(key.encode("utf-8")).hexdigest())
+        return name + ".json"
+
+    def _path(self, key):
+        return os.path.join(self.directory, self._filename(key))
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        return entry if entry.get("key") == key else None
+
+    def set(self, key, entry):
+        path = self._path(key)
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with open(tmp_path, "w") as f:
+            json.dump(dict(entry, key=key), f)
+        os.replace(tmp_path, path)
+
+    def invalidate(self, prefixes=(), keys=()):
+        # Quoting keeps prefixes, so prefixes can be compared with the quoted names
+        prefixes = [quote(prefix, safe="") for prefix in prefixes]
+        filenames = {self._filename(key) for key in keys}
+        with self._lock:
+            for filename in os.listdir(self.directory):
+                if not filename.endswith(".json"):
+                    continue
+                start, cut, _ = filename[:-len(".json")].partition("#")
+                # The key of a cut name is only known to start with start, so those are dropped if they may match
+                if filename in filenames or any(start.startswith(prefix) or (cut and prefix.startswith(start))
+                                                for prefix in prefixes):
+                    try:
+                        os.remove(os.path.join(self.directory, filename))
+                    except OSError:
+                        continue
@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import hashlib
+import threading
+from array import array
+from bisect import bisect_left
+
+from pyzenobase.zenobase_event import json_default
+
+
+def event_hash(event):
+    """
+        Returns a 64 bit hash of the event, stable across processes and runs.
+
+        The hash is computed over the canonical JSON encoding of the event, so two events
+        hash the same if and only if they would be uploaded as the same JSON object
+        (ignoring key order). Construct ZenobaseEvents first so that equal events are
+        cleaned into the same representation.
+    """
+    data = json.dumps(event, sort_keys=True, separators=(",", ":"), default=json_default)
+    return int.from_bytes(hashlib.blake2b(data.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _read_hashes(path):
+    hashes = array("Q")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            hashes.frombytes(f.read())
+        if sys.byteorder == "big":
+            hashes.byteswap()
+    return hashes
+
+
+def _to_bytes(hashes):
+    if sys.byteorder == "big":
+        hashes = array("Q", hashes)
+        hashes.byteswap()
+    return hashes.tobytes()
+
+
+def _merge(sorted_hashes, new_hashes):
+    """Merges the sorted new_hashes (few) into the sorted array sorted_hashes (many) in linear time"""
+    merged = array("Q")
+    start = 0
+    for h in new_hashes:
+        i = bisect_left(sorted_hashes, h, start)
+        merged += sorted_hashes[start:i]
+        merged.append(h)
+        start = i
+    merged += sorted_hashes[start:]
+    return merged
+
+
+class DedupIndex:
+    """
+        Set of the event hashes that have been uploaded to a bucket.
+
+        Hashes are kept in a sorted array of 64 bit integers (8 bytes per event) plus a
+        small set of recently added hashes that is merged into the array when it grows
+        past merge_threshold. If path is given the sorted array is stored in that file,
+        rewritten on every merge, and recent hashes are appended to path + ".new" as
+        they are added, so loading an index never has to sort it.
+    """
+
+    def __init__(self, path=None, merge_threshold=65536):
+        self.path = path
+        self.merge_threshold = merge_threshold
+        self._sorted = array("Q")
+        self._recent = set()
+        self._lock = threading.Lock()
+        if path is not None:
+            self._sorted = _read_hashes(path)
+            # Recent hashes may already be in the array if a merge was interrupted
+            self._recent = {h for h in _read_hashes(path + ".new") if not self._contains(h)}
+
+    def __contains__(self, h):
+        with self._lock:
+            return self._contains(h)
+
+    def _contains(self, h):
+        if h in self._recent:
+            return True
+        i = bisect_left(self._sorted, h)
+        return i < len(self._sorted) and self._sorted[i] == h
+
+    def __len__(self):
+        return len(self._sorted) + len(self._recent)
+
+    def add_all(self, hashes):
+        with self._lock:
+            new = array("Q", (h for h in set(hashes) if not self._contains(h)))
+            if not new:
+                return
+            self._recent.update(new)
+            if self.path is not None:
+                with open(self.path + ".new", "ab") as f:
+                    f.write(_to_bytes(new))
+            if len(self._recent) > self.merge_threshold:
+                self._merge()
+
+    def _merge(self):
+        self._sorted = _merge(self._sorted, sorted(self._recent))
+        self._recent = set()
+        if self.path is not None:
+            # The new array replaces the old one atomically before the recent hashes are dropped
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(_to_bytes(self._sorted))
+            os.replace(tmp_path, self.path)
+            open(self.path + ".new", "wb").close()
+
+
+class DedupStore:
+    """
+        Gives each bucket its own DedupIndex, stored as {bucket_id}.hashes in directory
+        (or only in memory if directory is None). Pass to ZenobaseAPI(dedup_store=...) to
+        make create_event and create_events skip events that have already been uploaded.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = os.path.expanduser(directory) if directory is not None else None
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def index(self, bucket_id):
+        with self._lock:
+            if bucket_id not in self._indexes:
+                path = os.path.join(self.directory, bucket_id + ".hashes") if self.directory is not None else None
+                self._indexes[bucket_id] = DedupIndex(path)
+            return self._indexes[bucket_id]
+
+    def forget(self, bucket_id):
+        with self._lock:
+            self._indexes.pop(bucket_id, None)
+            if self.directory is not None:
+                path = os.path.join(self.directory, bucket_id + ".hashes")
+                for path in [path, path + ".new"]:
+                    if os.path.exists(path):
+                        os.remove(path)
@@ -0,0 +1,149 @@
+"""
+    Dumps all buckets and events of a Zenobase account to NDJSON files.
+
+        python -m pyzenobase.dump USERNAME PASSWORD [--output-dir DIR] [--separate] [--workers N]
+
+    Buckets are fetched concurrently and events are streamed to disk page by page,
+    so memory use stays constant no matter how large the account is.
+
+    Output (in output-dir):
+     - zenobase-dump-{username}-buckets-{date}.ndjson: One line of metadata per bucket
+     - zenobase-dump-{username}-events-{date}.ndjson: One {"bucket": id, "event": {...}} line per event
+    or with --separate, instead of the latter, one file of events per bucket (named by
+    id as labels need not be unique, the label is only kept for readability):
+     - zenobase-dump-{username}-bucket-{id}-{label}-{date}.ndjson
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from datetime import datetime
+
+from pyzenobase import ZenobaseAPI, bounded_map
+
+
+class DumpProgress:
+    """Thread-safe counters that print throughput to file at most every interval seconds"""
+
+    def __init__(self, n_buckets, interval=2, file=sys.stderr):
+        self.n_buckets = n_buckets
+        self.interval = interval
+        self.file = file
+        self.buckets_done = 0
+        self.events = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self._last_report = self.started
+        self._lock = threading.Lock()
+
+    def add(self, events, n_bytes):
+        with self._lock:
+            self.events += events
+            self.bytes += n_bytes
+        self.report()
+
+    def bucket_done(self):
+        with self._lock:
+            self.buckets_done += 1
+        self.report()
+
+    def report(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            if self.file is None or (not force and now - self._last_report < self.interval):
+                return
+            self._last_report = now
+            elapsed = max(now - self.started, 1e-9)
+            print("{}/{} buckets, {} events, {:.0f} events/s, {:.2f} MB/s".format(
+                self.buckets_done, self.n_buckets, self.events,
+                self.events / elapsed, self.bytes / elapsed / 1e6), file=self.file)
+
+
+def _build_filename(username, label, date):
+    return "zenobase-dump-{}-{}-{}.ndjson".format(username, label, date)
+
+
+def _bucket_filename_label(bucket):
+    # Characters that are unsafe in filenames (such as "/") are replaced in the label
+    return "bucket-{}-{}".format(bucket["@id"], re.sub(r"[^\w.-]+", "_", bucket["label"]))
+
+
+def dump(zapi, output_dir=".", username=None, separate=False, max_workers=4, page_size=100, progress=True):
+    """
+        Dumps every bucket of the account zapi is authenticated with into output_dir,
+        see the module docstring for the output format. Returns the DumpProgress.
+    """
+    username = username or zapi.client_id
+    date = datetime.now().isoformat().split(".")[0]
+
+    def path(label):
+        return os.path.join(output_dir, _build_filename(username, label, date))
+
+    buckets = []
+    with open(path("buckets"), "w") as f:
+        for bucket in zapi.iter_buckets():
+            f.write(json.dumps(bucket) + "\n")
+            buckets.append({"@id": bucket["@id"], "label": bucket["label"]})
+
+    stats = DumpProgress(len(buckets), file=sys.stderr if progress else None)
+    events_file = None if separate else open(path("events"), "w")
+    events_file_lock = threading.Lock()
+
+    def dump_bucket(bucket):
+        f = open(path(_bucket_filename_label(bucket)), "w") if separate else None
+        try:
+            lines = []
+            for event in zapi.iter_events(bucket["@id"], page_size=page_size):
+                lines.append(json.dumps(event if separate else {"bucket": bucket["@id"], "event": event}))
+                if len(lines) >= page_size:
+                    write(f, lines)
+                    lines = []
+            write(f, lines)
+        finally:
+            if f is not None:
+                f.close()
+        stats.bucket_done()
+
+    def write(f, lines):
+        if not lines:
+            return
+        data = "\n".join(lines) + "\n"
+        if f is not None:
+            f.write(data)
+        else:
+            with events_file_lock:
+                events_file.write(data)
+        stats.add(len(lines), len(data))
+
+    try:
+        for bucket, _, error in bounded_map(dump_bucket, buckets, max_workers=max_workers):
+            if error is not None:
+                raise Exception("Failed to dump bucket '{}' ({})".format(bucket["label"], bucket["@id"])) from error
+    finally:
+        if events_file is not None:
+            events_file.close()
+    stats.report(force=True)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dump all buckets and events of a Zenobase account to NDJSON")
+    parser.add_argument("username")
+    parser.add_argument("password")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--separate", action="store_true", help="Save the events of each bucket in a separate file")
+    parser.add_argument("--workers", type=int, default=4, help="Number of buckets to fetch concurrently")
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    with ZenobaseAPI(args.username, args.password, pool_size=args.workers * 2) as zapi:
+        dump(zapi, output_dir=args.output_dir, username=args.username, separate=args.separate,
+             max_workers=args.workers, page_size=args.page_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import json
+import zlib
+
+from pyzenobase.zenobase_event import json_default
+
+EVENTS_PREFIX = b'{"events": ['
+EVENTS_SEPARATOR = b', '
+EVENTS_SUFFIX = b']}'
+
+
+def dumps(obj):
+    """The default JSON backend, json.dumps that also handles CompactZenobaseEvents"""
+    return json.dumps(obj, default=json_default)
+
+
+class EventsBody:
+    """
+        A {"events": [...]} request body that is encoded incrementally and iterated over
+        in chunks of about chunk_size bytes, so it can be sent (chunked) while it is being
+        encoded and never has to be held in memory as a whole.
+
+        If dumps is None the events must already be encoded (as str or bytes), otherwise
+        dumps is called on each event as it is reached. It may return str or bytes, so
+        faster JSON libraries can be plugged in. The body can be iterated over more than
+        once, which lets failed requests be retried.
+    """
+
+    def __init__(self, events, dumps=None, chunk_size=65536):
+        self.events = events
+        self.dumps = dumps
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        chunk = bytearray(EVENTS_PREFIX)
+        for i, event in enumerate(self.events):
+            encoded = self.dumps(event) if self.dumps is not None else event
+            if isinstance(encoded, str):
+                encoded = encoded.encode("utf-8")
+            if i:
+                chunk += EVENTS_SEPARATOR
+            chunk += encoded
+            if len(chunk) >= self.chunk_size:
+                yield bytes(chunk)
+                chunk = bytearray()
+        chunk += EVENTS_SUFFIX
+        yield bytes(chunk)
+
+    def to_bytes(self):
+        return b"".join(self)
+
+
+class GzipBody:
+    """
+        Re-iterable, gzip compressed version of an iterable request body (such as an
+        EventsBody) that is compressed chunk by chunk as it is iterated over.
+    """
+
+    def __init__(self, body, level=6):
+        self.body = body
+        self.level = level
+
+    def __iter__(self):
+        # wbits=31 produces the gzip format rather than raw zlib
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        for chunk in self.body:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
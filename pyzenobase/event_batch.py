@@ -0,0 +1,155 @@
+import json
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from pyzenobase import fmt_datetime, fmt_datetimes
+from pyzenobase.zenobase_event import _VALID_FIELDS, normalize_unit
+
+# Fields with plain numeric values and the type Zenobase expects
+_NUMERIC_FIELDS = {"count": int, "percentage": float, "rating": int}
+
+# Fields whose values are {"@value": ..., "unit": ...} objects
+_UNIT_FIELDS = frozenset(["bits", "concentration", "currency", "distance", "distance/volume", "duration",
+                          "energy", "frequency", "height", "humidity", "pace", "pressure", "sound",
+                          "temperature", "velocity", "volume", "weight"])
+
+# Timestamp formats that NumPy can parse in a single vectorised call, with the shape of
+# their values ("0" standing for any digit). NumPy is more lenient than strptime (it also
+# accepts dates without a time, for example), so values are checked against it first.
+_NUMPY_TIMESTAMP_FORMATS = {"%Y-%m-%d %H:%M:%S": "0000-00-00 00:00:00",
+                            "%Y-%m-%dT%H:%M:%S": "0000-00-00T00:00:00",
+                            "%Y-%m-%d": "0000-00-00"}
+
+
+class EventBatch:
+    """
+        A batch of events stored as columns, such as the columns of a CSV file or NumPy arrays
+        from a sensor log, that are validated and converted one column at a time.
+
+            batch = EventBatch(timestamp=dates, timestamp_format="%Y-%m-%d %H:%M:%S",
+                               timezone="Europe/Stockholm",
+                               tag=statuses, percentage=levels, temperature=(temperatures, "C"))
+            zapi.create_events(bucket, batch)
+
+        Every column has one value per event. Strings, numbers and datetimes are instead used
+        for all events. Columns of fields that carry units (weight, volume, temperature, ...) are
+        always given as a (values, unit) tuple. Missing numeric values (NaN) are left out of their event.
+
+        timestamp can be datetimes (naive ones are interpreted as local time in timezone,
+        see fmt_datetimes), a NumPy datetime64 array, strings to parse with timestamp_format,
+        or already formatted strings if timestamp_format is None.
+    """
+
+    def __init__(self, timestamp=None, timestamp_format=None, timezone=None, **columns):
+        if timestamp is not None:
+            columns = dict(timestamp=timestamp, **columns)
+        invalid_fields = set(columns) - _VALID_FIELDS
+        if invalid_fields:
+            raise ValueError("Invalid fields: {}".format(invalid_fields))
+
+        lengths = {len(column[0] if field in _UNIT_FIELDS else column)
+                   for field, column in columns.items() if not self._is_scalar(column)}
+        if len(lengths) > 1:
+            raise ValueError("All columns must have the same length, got lengths {}".format(sorted(lengths)))
+        self._length = lengths.pop() if lengths else 1
+
+        self._columns = {}
+        for field, column in columns.items():
+            if field == "timestamp" and self._is_scalar(column):
+                # Parsed and formatted like a column, then used for all events
+                self._columns[field] = self._convert_timestamps([column], timestamp_format, timezone) * self._length
+            elif self._is_scalar(column):
+                self._columns[field] = [column] * self._length
+            elif field == "timestamp":
+                self._columns[field] = self._convert_timestamps(column, timestamp_format, timezone)
+            elif field in _UNIT_FIELDS:
+                values, unit = column
+                self._columns[field] = self._convert_measures(values, normalize_unit(field, unit))
+            elif field in _NUMERIC_FIELDS:
+                self._columns[field] = self._convert_numbers(column, _NUMERIC_FIELDS[field])
+            else:
+                self._columns[field] = self._to_list(column)
+
+    @staticmethod
+    def _is_scalar(column):
+        return isinstance(column, (str, int, float, datetime))
+
+    @staticmethod
+    def _to_list(values):
+        return values.tolist() if hasattr(values, "tolist") else list(values)
+
+    @classmethod
+    def _convert_numbers(cls, values, to_type):
+        """Converts the whole column at once, NaN and empty strings (missing values) become None"""
+        if np is not None:
+            array = np.asarray(values)
+            if array.dtype.kind in "US":
+                array = np.where(np.char.strip(array) == "", "nan", array)
+            array = array.astype(float)
+            missing = np.isnan(array)
+            if to_type is int:
+                array = np.where(missing, 0, array).astype(int)
+            converted = array.astype(object)
+            converted[missing] = None
+            return converted.tolist()
+        converted = [float(value) if not isinstance(value, str) or value.strip() else float("nan")
+                     for value in values]
+        return [None if value != value else to_type(value) for value in converted]
+
+    @classmethod
+    def _convert_measures(cls, values, unit):
+        return [None if value is None else {"@value": value, "unit": unit}
+                for value in cls._convert_numbers(values, float)]
+
+    @staticmethod
+    def _matches_shape(values, shape):
+        """Whether all values are strings of the given shape, such as "0000-00-00" for dates"""
+        if shape is None:
+            return False
+        try:
+            chars = np.asarray(values, dtype="S{}".format(len(shape) + 1))
+        except (UnicodeEncodeError, ValueError, TypeError):
+            return False
+        if chars.ndim != 1 or chars.dtype.kind != "S" or not (np.char.str_len(chars) == len(shape)).all():
+            return False
+        chars = chars.astype("S{}".format(len(shape))).view(np.uint8).reshape(len(chars), len(shape))
+        expected = np.frombuffer(shape.encode("ascii"), dtype=np.uint8)
+        digits = expected == ord("0")
+        return bool((chars[:, ~digits] == expected[~digits]).all() and
+                    ((chars[:, digits] >= ord("0")) & (chars[:, digits] <= ord("9"))).all())
+
+    @classmethod
+    def _convert_timestamps(cls, values, timestamp_format, timezone):
+        if timestamp_format is not None:
+            if np is not None and cls._matches_shape(values, _NUMPY_TIMESTAMP_FORMATS.get(timestamp_format)):
+                values = np.asarray(values, dtype="datetime64[s]")
+            else:
+                values = [datetime.strptime(value, timestamp_format) for value in values]
+        if getattr(values, "dtype", None) is not None and values.dtype.kind == "M":
+            return fmt_datetimes(values, timezone)
+        values = cls._to_list(values)
+        if all(isinstance(value, datetime) for value in values):
+            return fmt_datetimes(values, timezone)
+        return [fmt_datetime(value, timezone) if isinstance(value, datetime) else value for value in values]
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        """Yields the events as dicts, ready to be JSON encoded"""
+        fields = list(self._columns)
+        for row in zip(*self._columns.values()):
+            yield {field: value for field, value in zip(fields, row) if value is not None}
+
+    def iter_json_batches(self, batch_size=1000):
+        """Yields {"events": [...]} request bodies of at most batch_size events each"""
+        events = iter(self)
+        while True:
+            batch = [event for _, event in zip(range(batch_size), events)]
+            if not batch:
+                break
+            yield json.dumps({"events": batch})
@@ -0,0 +1,172 @@
+"""
+    Streaming upload of CSV files (such as sensor or app logs) to a bucket.
+
+        mapping = ColumnMapping(timestamp="datetime", timestamp_format="%Y-%m-%d %H:%M:%S",
+                                timezone="Europe/Stockholm",
+                                fields={"tag": "status", "percentage": "level",
+                                        "temperature": ("temperature", "C")},
+                                tags=["battery"])
+        ingest_csv(zapi, bucket, "battery.csv", mapping)
+
+    Reading, converting (into EventBatches, a chunk of rows at a time) and uploading run
+    concurrently in their own threads, connected by bounded queues. A slow upload makes
+    the earlier stages wait rather than read ahead, so memory use is bounded by the chunk
+    size and queue size no matter how large the file is.
+"""
+
+import csv
+import queue
+import threading
+
+from pyzenobase import EventBatch
+from pyzenobase.event_batch import _UNIT_FIELDS
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class ColumnMapping:
+    """
+        Describes how the columns of a CSV file become event fields.
+
+        timestamp is the name of the timestamp column, parsed with timestamp_format (None if
+        the values are already Zenobase timestamps) in timezone. fields maps event fields to
+        column names, or to (column, unit) tuples for fields that carry units. tags are added
+        to the tags of every event. Empty numeric values are left out of their event.
+    """
+
+    def __init__(self, timestamp, timestamp_format=None, timezone=None, fields=None, tags=None):
+        self.timestamp = timestamp
+        self.timestamp_format = timestamp_format
+        self.timezone = timezone
+        self.fields = dict(fields or {})
+        self.tags = list(tags or [])
+        for field, column in self.fields.items():
+            if field in _UNIT_FIELDS and not isinstance(column, tuple):
+                raise ValueError("The {} field carries a unit, map it to a (column, unit) tuple".format(field))
+
+    def columns(self):
+        return [self.timestamp] + [column[0] if isinstance(column, tuple) else column
+                                   for column in self.fields.values()]
+
+    def check_header(self, header):
+        missing = [column for column in self.columns() if column not in header]
+        if missing:
+            raise ValueError("Missing columns: {}".format(missing))
+
+    def to_batch(self, header, rows):
+        """Converts rows (lists of values ordered as header) into an EventBatch"""
+        self.check_header(header)
+        index = {name: i for i, name in enumerate(header)}
+
+        def column(name):
+            i = index[name]
+            return [row[i] for row in rows]
+
+        columns = {}
+        for field, source in self.fields.items():
+            if field in _UNIT_FIELDS:
+                columns[field] = (column(source[0]), source[1])
+            else:
+                columns[field] = column(source)
+        if self.tags:
+            columns["tag"] = [[tag] + self.tags for tag in columns["tag"]] if "tag" in columns \
+                else [list(self.tags) for _ in rows]
+        return EventBatch(timestamp=column(self.timestamp), timestamp_format=self.timestamp_format,
+                          timezone=self.timezone, **columns)
+
+
+def _put(q, item, stop):
+    """Puts item on q unless stop is set while waiting for room, returns whether it was put"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(q, stop):
+    """
+        Yields the items of q until the stage feeding it is done (re-raising its exception
+        if it failed) or stop is set
+    """
+    while not stop.is_set():
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        if isinstance(item, _Failure):
+            raise item.exception
+        yield item
+
+
+def _run_stage(fn, items, out, stop):
+    try:
+        for item in items:
+            if not _put(out, fn(item), stop):
+                return
+    except Exception as e:
+        _put(out, _Failure(e), stop)
+        return
+    _put(out, _DONE, stop)
+
+
+def _read_chunks(reader, chunk_size):
+    chunk = []
+    for row in reader:
+        if not row:
+            continue
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ingest_csv(zapi, bucket, csvfile, mapping, chunk_size=1000, queue_size=4, delimiter=",", **upload_kwargs):
+    """
+        Uploads the rows of csvfile (a path or a file opened with newline="") to bucket
+        according to mapping, see the module docstring. Rows are read and converted
+        chunk_size at a time, at most queue_size chunks wait between stages.
+
+        upload_kwargs are passed to zapi.create_events (batch_size, max_workers,
+        raise_on_error, journal, source, ...), whose BatchResults are returned.
+    """
+    if isinstance(csvfile, str):
+        with open(csvfile, newline="") as f:
+            return ingest_csv(zapi, bucket, f, mapping, chunk_size, queue_size, delimiter, **upload_kwargs)
+
+    reader = csv.reader(csvfile, delimiter=delimiter)
+    header = next(reader)
+    mapping.check_header(header)
+
+    def to_batch(chunk):
+        return mapping.to_batch(header, chunk)
+
+    rows, batches = queue.Queue(maxsize=queue_size), queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    stages = [threading.Thread(target=_run_stage, args=(list, _read_chunks(reader, chunk_size), rows, stop),
+                               daemon=True),
+              threading.Thread(target=_run_stage, args=(to_batch, _drain(rows, stop), batches, stop), daemon=True)]
+    for stage in stages:
+        stage.start()
+
+    def events():
+        for batch in _drain(batches, stop):
+            yield from batch
+
+    try:
+        return zapi.create_events(bucket, events(), **upload_kwargs)
+    finally:
+        stop.set()
+        for stage in stages:
+            stage.join()
@@ -0,0 +1,70 @@
+import os
+import json
+import threading
+
+
+class UploadJournal:
+    """
+        On-disk record of which parts of an upload have been acknowledged by Zenobase,
+        so that a failed or interrupted create_events can be resumed by running it again.
+
+        Entries are keyed by bucket and source, a name for the input (such as the path of
+        the file the events are read from), and store ranges of event positions in that
+        input. The journal file is append-only, one JSON object per line, and every entry
+        is flushed to disk before the batch is considered done.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self._ranges = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    # The last line may be incomplete if the process died while writing it
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._add_range(entry["bucket"], entry["source"], entry["start"], entry["end"])
+
+    def _add_range(self, bucket_id, source, start, end):
+        self._ranges.setdefault((bucket_id, source), []).append((start, end))
+
+    def completed(self, bucket_id, source):
+        """Returns the sorted, merged list of acknowledged (start, end) position ranges"""
+        with self._lock:
+            merged = []
+            for start, end in sorted(self._ranges.get((bucket_id, source), [])):
+                if merged and start <= merged[-1][1]:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+                else:
+                    merged.append((start, end))
+            return merged
+
+    def resume_offset(self, bucket_id, source):
+        """
+            Returns the number of leading events of the source that have all been uploaded,
+            a reader can skip that many events (passing offset to create_events) on resume.
+        """
+        completed = self.completed(bucket_id, source)
+        return completed[0][1] if completed and completed[0][0] == 0 else 0
+
+    def record(self, bucket_id, source, start, end):
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"bucket": bucket_id, "source": source, "start": start, "end": end}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._add_range(bucket_id, source, start, end)
+
+    def clear(self, bucket_id, source):
+        """Forgets the progress of an upload, rewriting the journal without its entries"""
+        with self._lock:
+            self._ranges.pop((bucket_id, source), None)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                for (b, s), ranges in self._ranges.items():
+                    for start, end in ranges:
+                        f.write(json.dumps({"bucket": b, "source": s, "start": start, "end": end}) + "\n")
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,180 @@
+import re
+import threading
+from collections import OrderedDict
+
+# Ids in endpoints are replaced by placeholders so that requests are grouped by route
+_ROUTE_PATTERNS = [
+    (re.compile(r"^/users/[^/?]+"), "/users/{user}"),
+    (re.compile(r"^/authorizations/[^/?]+"), "/authorizations/{token}"),
+    (re.compile(r"^/buckets/[^/?]+/[^/?]+"), "/buckets/{bucket}/{event}"),
+    (re.compile(r"^/buckets/[^/?]+"), "/buckets/{bucket}"),
+]
+
+
+def route(endpoint):
+    """The endpoint without its query string and with ids replaced, e.g. /buckets/{bucket}/"""
+    endpoint = endpoint.split("?", 1)[0]
+    for pattern, replacement in _ROUTE_PATTERNS:
+        endpoint, n = pattern.subn(replacement, endpoint, count=1)
+        if n:
+            break
+    return endpoint
+
+
+class RequestInfo:
+    """
+        Measurements of a single ZenobaseAPI request, passed to the client's observers
+        once the request has completed or failed.
+
+        Times are in seconds. wait_time is spent in the transport (connecting, sending,
+        waiting for and receiving the response) summed over all attempts, server_time is
+        the part of it until the response headers arrived. Streamed bodies are encoded
+        while being sent, so their encoding is part of wait_time rather than encode_time.
+    """
+
+    __slots__ = ("method", "endpoint", "route", "events", "status_code", "attempts", "request_bytes",
+                 "response_bytes", "encode_time", "wait_time", "server_time", "backoff_time", "decode_time",
+                 "total_time", "cached", "error")
+
+    def __init__(self, method, endpoint, events=None):
+        self.method = method
+        self.endpoint = endpoint
+        self.route = route(endpoint)
+        self.events = events
+        self.status_code = None
+        self.attempts = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.encode_time = 0.0
+        self.wait_time = 0.0
+        self.server_time = 0.0
+        self.backoff_time = 0.0
+        self.decode_time = 0.0
+        self.total_time = 0.0
+        self.cached = False
+        self.error = None
+
+    @property
+    def retries(self):
+        return max(self.attempts - 1, 0)
+
+    def to_dict(self):
+        return dict({name: getattr(self, name) for name in self.__slots__}, retries=self.retries)
+
+    def __repr__(self):
+        return "<RequestInfo {} {} {} in {:.3f}s>".format(self.method, self.endpoint, self.status_code,
+                                                          self.total_time)
+
+
+class Metrics:
+    """
+        Observer that keeps running counters and latency histograms of requests by method
+        and route, for ZenobaseAPI(observers=[metrics]). Export them with snapshot() or in
+        the Prometheus text format with to_prometheus().
+    """
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    _PHASES = ("encode", "wait", "server", "backoff", "decode")
+
+    def __init__(self, latency_buckets=LATENCY_BUCKETS, namespace="pyzenobase"):
+        self.latency_buckets = tuple(sorted(latency_buckets))
+        self.namespace = namespace
+        self._routes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _new_route(self):
+        return {"requests": 0, "errors": 0, "retries": 0, "cached": 0, "events": 0,
+                "request_bytes": 0, "response_bytes": 0, "status_codes": {},
+                "phase_seconds": dict.fromkeys(self._PHASES, 0.0),
+                "latency": {"count": 0, "sum": 0.0, "buckets": [0] * len(self.latency_buckets)}}
+
+    def __call__(self, info):
+        with self._lock:
+            key = (info.method, info.route)
+            stats = self._routes.get(key)
+            if stats is None:
+                stats = self._routes[key] = self._new_route()
+            stats["requests"] += 1
+            stats["errors"] += info.error is not None
+            stats["retries"] += info.retries
+            stats["cached"] += info.cached
+            stats["events"] += info.events or 0
+            stats["request_bytes"] += info.request_bytes
+            stats["response_bytes"] += info.response_bytes
+            status = info.status_code if info.status_code is not None else "error"
+            stats["status_codes"][status] = stats["status_codes"].get(status, 0) + 1
+            for phase in self._PHASES:
+                stats["phase_seconds"][phase] += getattr(info, phase + "_time")
+
+            latency = stats["latency"]
+            latency["count"] += 1
+            latency["sum"] += info.total_time
+            for i, upper_bound in enumerate(self.latency_buckets):
+                if info.total_time <= upper_bound:
+                    latency["buckets"][i] += 1
+                    break
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+    def snapshot(self):
+        """
+            Returns {"METHOD /route": stats} where stats holds the counters, the seconds spent
+            in each phase and the latency histogram with cumulative counts by upper bound.
+        """
+        with self._lock:
+            snapshot = {}
+            for (method, route_), stats in self._routes.items():
+                stats = dict(stats, status_codes=dict(stats["status_codes"]),
+                             phase_seconds=dict(stats["phase_seconds"]))
+                cumulative, buckets = 0, OrderedDict()
+                for upper_bound, n in zip(self.latency_buckets, stats["latency"]["buckets"]):
+                    cumulative += n
+                    buckets[upper_bound] = cumulative
+                buckets[float("inf")] = stats["latency"]["count"]
+                stats["latency"] = dict(stats["latency"], buckets=buckets)
+                snapshot["{} {}".format(method, route_)] = stats
+            return snapshot
+
+    def to_prometheus(self):
+        """The metrics in the Prometheus text exposition format"""
+        metrics = OrderedDict()
+
+        def add(name, kind, help_text, labels, value):
+            metric = metrics.setdefault(name, (kind, help_text, []))
+            label_text = ",".join('{}="{}"'.format(label, str(label_value).replace('"', '\\"'))
+                                  for label, label_value in labels)
+            metric[2].append("{}_{}{{{}}} {}".format(self.namespace, name, label_text, value))
+
+        for key, stats in self.snapshot().items():
+            method, route_ = key.split(" ", 1)
+            labels = [("method", method), ("route", route_)]
+            for status, n in sorted(stats["status_codes"].items(), key=str):
+                add("requests_total", "counter", "Requests made", labels + [("status", status)], n)
+            add("request_retries_total", "counter", "Retried attempts", labels, stats["retries"])
+            add("request_errors_total", "counter", "Requests that raised", labels, stats["errors"])
+            add("request_cache_hits_total", "counter", "Requests answered from the response cache", labels,
+                stats["cached"])
+            add("events_total", "counter", "Events sent", labels, stats["events"])
+            add("sent_bytes_total", "counter", "Request body bytes sent", labels, stats["request_bytes"])
+            add("received_bytes_total", "counter", "Response body bytes received", labels, stats["response_bytes"])
+            for phase, seconds in stats["phase_seconds"].items():
+                add("request_phase_seconds_total", "counter", "Seconds spent in each phase of requests",
+                    labels + [("phase", phase)], seconds)
+            for upper_bound, n in stats["latency"]["buckets"].items():
+                le = "+Inf" if upper_bound == float("inf") else "{:g}".format(upper_bound)
+                add("request_duration_seconds_bucket", "histogram", "Request latency", labels + [("le", le)], n)
+            add("request_duration_seconds_sum", "histogram", "Request latency", labels, stats["latency"]["sum"])
+            add("request_duration_seconds_count", "histogram", "Request latency", labels, stats["latency"]["count"])
+
+        lines = []
+        for name, (kind, help_text, samples) in metrics.items():
+            # The samples of a histogram share the HELP and TYPE lines of its base name
+            if not name.endswith(("_sum", "_count")):
+                base = name[:-len("_bucket")] if name.endswith("_bucket") else name
+                lines.append("# HELP {}_{} {}".format(self.namespace, base, help_text))
+                lines.append("# TYPE {}_{} {}".format(self.namespace, base, kind))
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
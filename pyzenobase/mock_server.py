@@ -0,0 +1,233 @@
+"""
+    An in-process stand-in for the Zenobase API, for testing and benchmarking clients
+    without network access or a Zenobase account.
+
+        with MockZenobaseServer(latency=0.01, error_rate=0.05) as server:
+            with ZenobaseAPI("user", "password", host=server.url) as zapi:
+                ...
+
+    It implements the endpoints ZenobaseAPI uses: /oauth/token, /users/{id}/buckets/,
+    /buckets/, /buckets/{id}, /buckets/{id}/ (events, with order/offset/limit and
+    q=tag:... as the only supported query),
+    /buckets/{id}/{event} and /authorizations/{token}. Request bodies may be chunked
+    and gzip compressed (content_encodings counts the requests by their Content-Encoding),
+    and GET responses have ETags. Every request is delayed by latency seconds and fails
+    with a 503 with probability error_rate.
+"""
+
+import gzip
+import json
+import time
+import uuid
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from pyzenobase import parse_datetime
+
+
+def _event_sort_key(event):
+    timestamp = event.get("timestamp")
+    if isinstance(timestamp, list):
+        timestamp = min(timestamp) if timestamp else None
+    return parse_datetime(timestamp).timestamp() if timestamp is not None else float("-inf")
+
+
+def _has_tag(event, tag):
+    tags = event.get("tag", [])
+    return tag in tags if isinstance(tags, list) else tag == tags
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that clients can keep connections alive
+    protocol_version = "HTTP/1.1"
+    # Otherwise the body, written after the headers, waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b"".join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def _respond(self, status, data=None):
+        body = json.dumps(data).encode("utf-8") if data is not None else b""
+        etag = None
+        if self.command == "GET" and status == 200:
+            etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+            if self.headers.get("If-None-Match") == etag:
+                status, body = 304, b""
+        self.send_response(status)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        if body:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        server = self.server.zenobase
+        body = self._read_body()
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+
+        with server.lock:
+            server.request_count += 1
+            encoding = self.headers.get("Content-Encoding", "identity")
+            server.content_encodings[encoding] = server.content_encodings.get(encoding, 0) + 1
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and server.random.random() < server.error_rate:
+            return self._respond(503, {"error": "unavailable"})
+
+        if method == "POST" and url.path == "/oauth/token":
+            return self._respond(*server.authenticate(parse_qs(body.decode("utf-8"))))
+        token = self.headers.get("Authorization", "")[len("Bearer "):]
+        if server.tokens.get(token, 0) < time.time():
+            return self._respond(401, {"error": "invalid_token"})
+
+        data = json.loads(body.decode("utf-8")) if body else None
+        with server.lock:
+            status, data = server.route(method, parts, url.path.endswith("/"), query, data)
+        self._respond(status, data)
+
+
+class MockZenobaseServer:
+    """
+        Serves a fake Zenobase account from memory on localhost (port 0 picks a free port).
+        If credentials ({username: password}) is given other logins are rejected, tokens
+        expire after token_ttl seconds. seed makes the injected errors reproducible.
+    """
+
+    def __init__(self, latency=0, error_rate=0, port=0, credentials=None, token_ttl=3600, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.credentials = credentials
+        self.token_ttl = token_ttl
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.buckets = {}
+        self.events = {}
+        self.request_count = 0
+        self.content_encodings = {}
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.zenobase = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self._httpd.server_address[1])
+
+    def start(self):
+        # Polls for shutdown often so that stop() doesn't hold up test suites
+        self._thread = threading.Thread(target=self._httpd.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def authenticate(self, form):
+        username = form.get("username", [None])[0]
+        if self.credentials is not None and self.credentials.get(username) != form.get("password", [None])[0]:
+            return 400, {"error": "invalid_grant"}
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = time.time() + self.token_ttl
+        return 200, {"access_token": token, "client_id": username or "client", "expires_in": self.token_ttl}
+
+    def route(self, method, parts, trailing_slash, query, data):
+        """Returns the (status, data) of an authenticated request, called with the lock held"""
+        if parts[0] == "authorizations" and method == "DELETE" and len(parts) == 2:
+            self.tokens.pop(parts[1], None)
+            return 204, None
+        if parts[0] == "users" and method == "GET" and len(parts) == 3:
+            return 200, self.list_buckets(query)
+        if parts[0] == "buckets":
+            return self.handle_bucket(method, parts[1:], trailing_slash, query, data)
+        return 404, {"error": "not_found"}
+
+    def list_buckets(self, query):
+        buckets = sorted(self.buckets.values(), key=lambda bucket: bucket["label"])
+        offset, limit = int(query.get("offset", 0)), int(query.get("limit", 100))
+        return {"total": len(buckets), "buckets": buckets[offset:offset + limit]}
+
+    def handle_bucket(self, method, parts, trailing_slash, query, data):
+        """Returns the (status, data) of a request to /buckets/..."""
+        if not parts or not parts[0]:
+            if method != "POST":
+                return 405, {"error": "method_not_allowed"}
+            bucket = {"@id": uuid.uuid4().hex[:12], "label": data["label"], "description": data.get("description", "")}
+            self.buckets[bucket["@id"]] = bucket
+            self.events[bucket["@id"]] = []
+            return 201, bucket
+
+        bucket_id = parts[0]
+        if bucket_id not in self.buckets:
+            return 404, {"error": "not_found"}
+        events = self.events[bucket_id]
+
+        if len(parts) == 1 and not trailing_slash:
+            if method == "GET":
+                return 200, dict(self.buckets[bucket_id], events=len(events))
+            if method == "DELETE":
+                del self.buckets[bucket_id], self.events[bucket_id]
+                return 204, None
+        elif len(parts) == 1 or not parts[1]:
+            if method == "GET":
+                if query.get("q", "").startswith("tag:"):
+                    events = [event for event in events if _has_tag(event, query["q"][len("tag:"):])]
+                order = query.get("order", "timestamp")
+                ordered = sorted(events, key=_event_sort_key, reverse=order.startswith("-"))
+                offset, limit = int(query.get("offset", 0)), int(query.get("limit", 100))
+                return 200, {"total": len(events), "events": ordered[offset:offset + limit]}
+            if method == "POST":
+                new_events = data["events"] if "events" in data else [data]
+                for event in new_events:
+                    event["@id"] = uuid.uuid4().hex[:12]
+                events.extend(new_events)
+                return 201, {"total": len(new_events)}
+        elif len(parts) == 2 and method == "DELETE":
+            remaining = [event for event in events if event["@id"] != parts[1]]
+            if len(remaining) == len(events):
+                return 404, {"error": "not_found"}
+            self.events[bucket_id] = remaining
+            return 204, None
+        return 405, {"error": "method_not_allowed"}
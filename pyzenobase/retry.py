@@ -0,0 +1,89 @@
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+class RetryPolicy:
+    """
+        Decides which failed requests ZenobaseAPI retries and how long it waits in between.
+
+        Requests that failed with a connection error, a timeout or one of retry_statuses
+        are retried up to max_retries times if their method is in retry_methods. 429 (Too
+        Many Requests) is retried for all methods since the server didn't process the request.
+        The wait before retry n (counting from 0) is drawn uniformly from
+        [0, min(max_backoff, backoff_factor * 2**n)] ("full jitter"), unless the response
+        had a Retry-After header, which is then obeyed instead (up to max_backoff).
+    """
+
+    def __init__(self, max_retries=3, backoff_factor=0.5, max_backoff=30, jitter=True,
+                 retry_statuses=(429, 500, 502, 503, 504),
+                 retry_methods=("GET", "HEAD", "OPTIONS", "PUT", "DELETE")):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_methods = frozenset(method.upper() for method in retry_methods)
+
+    def should_retry(self, method, attempt, status_code=None, idempotent=False):
+        """
+            status_code is None if the request failed without a response. idempotent
+            requests (such as logging in) are retried whatever their method.
+        """
+        if attempt >= self.max_retries:
+            return False
+        if status_code == 429:
+            return True
+        if method.upper() not in self.retry_methods and not idempotent:
+            return False
+        return status_code is None or status_code in self.retry_statuses
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(self.max_backoff, retry_after)
+        backoff = min(self.max_backoff, self.backoff_factor * 2 ** attempt)
+        return random.uniform(0, backoff) if self.jitter else backoff
+
+    @staticmethod
+    def parse_retry_after(value):
+        """Returns the seconds to wait given a Retry-After header (seconds or HTTP date), or None"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+
+class RateLimiter:
+    """
+        Token bucket allowing on average rate requests per second with bursts of up to
+        burst requests. Thread-safe, so one limiter can be shared by all threads using a
+        client (or by several clients). Waiting callers are served in order.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Blocks until tokens are available, returns the seconds spent waiting"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            # Tokens may go negative, which reserves them for this caller ahead of later ones
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
@@ -0,0 +1,226 @@
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime
+
+from pyzenobase import fmt_datetime, parse_datetime
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    id TEXT PRIMARY KEY,
+    label TEXT,
+    data TEXT NOT NULL,
+    synced_at REAL
+);
+CREATE INDEX IF NOT EXISTS buckets_label ON buckets (label);
+
+CREATE TABLE IF NOT EXISTS events (
+    rowid INTEGER PRIMARY KEY,
+    bucket_id TEXT NOT NULL,
+    event_id TEXT,
+    timestamp REAL,
+    data TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS events_bucket_event ON events (bucket_id, event_id);
+CREATE INDEX IF NOT EXISTS events_bucket_timestamp ON events (bucket_id, timestamp);
+
+CREATE TABLE IF NOT EXISTS event_tags (
+    event_rowid INTEGER NOT NULL REFERENCES events (rowid) ON DELETE CASCADE,
+    tag TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS event_tags_tag ON event_tags (tag, event_rowid);
+CREATE INDEX IF NOT EXISTS event_tags_event ON event_tags (event_rowid);
+"""
+
+# Events downloaded by a full sync, until they replace the stored events of their bucket
+_TEMP_SCHEMA = """
+CREATE TEMP TABLE staged_events (
+    bucket_id TEXT NOT NULL,
+    timestamp REAL,
+    data TEXT NOT NULL
+);
+"""
+
+
+def _to_epoch(timestamp):
+    """Seconds since the epoch of a Zenobase timestamp string or datetime (naive ones are local time)"""
+    if isinstance(timestamp, datetime):
+        timestamp = fmt_datetime(timestamp)
+    return parse_datetime(timestamp).timestamp()
+
+
+def _event_epoch(event):
+    timestamp = event.get("timestamp")
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, list):
+        return min(_to_epoch(ts) for ts in timestamp) if timestamp else None
+    return _to_epoch(timestamp)
+
+
+def _event_tags(event):
+    tags = event.get("tag", [])
+    return [tags] if isinstance(tags, str) else tags
+
+
+class LocalStore:
+    """
+        Local SQLite mirror of buckets and events, for fast repeated queries without
+        downloading whole buckets again.
+
+            with LocalStore("zenobase.db") as store:
+                store.sync(zapi)  # Only fetches events newer than those already stored
+                events = store.events(bucket_id, start=datetime(2015, 1, 1), tag="coffee")
+
+        Events are indexed by bucket, timestamp (the earliest if an event has several)
+        and tag. Pass ":memory:" (the default) as path for a store that isn't saved.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.executescript(_TEMP_SCHEMA)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def sync(self, zapi, full=False, page_size=100):
+        """Mirrors all buckets of the account and syncs the events of each, see sync_bucket"""
+        buckets = list(zapi.iter_buckets())
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO buckets (id, label, data, synced_at) "
+                                   "VALUES (?, ?, ?, (SELECT synced_at FROM buckets WHERE id = ?))",
+                                   [(b["@id"], b["label"], json.dumps(b), b["@id"]) for b in buckets])
+            # Remove buckets that have been deleted from Zenobase
+            bucket_ids = [b["@id"] for b in buckets]
+            for (bucket_id,) in self._conn.execute("SELECT id FROM buckets").fetchall():
+                if bucket_id not in bucket_ids:
+                    self._delete_bucket(bucket_id)
+        for bucket in buckets:
+            self.sync_bucket(zapi, bucket["@id"], full=full, page_size=page_size)
+
+    def sync_bucket(self, zapi, bucket_id, full=False, page_size=100):
+        """
+            Fetches the events of a bucket that are newer than the latest one stored, newest
+            first, stopping at the first event older than that. Events are stored by their
+            @id so events at the latest stored timestamp are refetched but not duplicated.
+            Returns the number of events fetched.
+
+            Events that are deleted or changed in Zenobase are only picked up with full=True,
+            which replaces all stored events of the bucket. They are replaced in one transaction
+            once all have been downloaded, so a failed full sync leaves the stored events as they were.
+        """
+        latest = None
+        if not full:
+            with self._lock:
+                latest = self._conn.execute("SELECT MAX(timestamp) FROM events WHERE bucket_id = ?",
+                                            (bucket_id,)).fetchone()[0]
+        save = self._stage_events if full else self._insert_events
+
+        fetched, page = 0, []
+        try:
+            for event in zapi.iter_events(bucket_id, page_size=page_size, order="-timestamp"):
+                epoch = _event_epoch(event)
+                if latest is not None and epoch is not None and epoch < latest:
+                    break
+                page.append((event, epoch))
+                if len(page) >= page_size:
+                    save(bucket_id, page)
+                    fetched += len(page)
+                    page = []
+            save(bucket_id, page)
+            fetched += len(page)
+
+            with self._lock, self._conn:
+                if full:
+                    self._conn.execute("DELETE FROM events WHERE bucket_id = ?", (bucket_id,))
+                    staged = self._conn.execute("SELECT data, timestamp FROM staged_events WHERE bucket_id = ? "
+                                                "ORDER BY rowid", (bucket_id,))
+                    self._insert_rows(bucket_id, ((json.loads(data), epoch) for data, epoch in staged))
+                self._conn.execute("UPDATE buckets SET synced_at = ? WHERE id = ?", (time.time(), bucket_id))
+        finally:
+            if full:
+                with self._lock, self._conn:
+                    self._conn.execute("DELETE FROM staged_events WHERE bucket_id = ?", (bucket_id,))
+        return fetched
+
+    def _stage_events(self, bucket_id, events):
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT INTO staged_events (bucket_id, timestamp, data) VALUES (?, ?, ?)",
+                                   [(bucket_id, epoch, json.dumps(event)) for event, epoch in events])
+
+    def _insert_events(self, bucket_id, events):
+        with self._lock, self._conn:
+            self._insert_rows(bucket_id, events)
+
+    def _insert_rows(self, bucket_id, events):
+        """Inserts (event, epoch) pairs, replacing stored events with the same @id. Call within a transaction."""
+        for event, epoch in events:
+            event_id = event.get("@id")
+            if event_id is not None:
+                self._conn.execute("DELETE FROM events WHERE bucket_id = ? AND event_id = ?", (bucket_id, event_id))
+            rowid = self._conn.execute("INSERT INTO events (bucket_id, event_id, timestamp, data) VALUES (?, ?, ?, ?)",
+                                       (bucket_id, event_id, epoch, json.dumps(event))).lastrowid
+            self._conn.executemany("INSERT INTO event_tags (event_rowid, tag) VALUES (?, ?)",
+                                   [(rowid, tag) for tag in _event_tags(event)])
+
+    def _delete_bucket(self, bucket_id):
+        self._conn.execute("DELETE FROM events WHERE bucket_id = ?", (bucket_id,))
+        self._conn.execute("DELETE FROM buckets WHERE id = ?", (bucket_id,))
+
+    def buckets(self):
+        with self._lock:
+            return [json.loads(data) for (data,) in self._conn.execute("SELECT data FROM buckets ORDER BY label")]
+
+    def get_bucket_by_label(self, label):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM buckets WHERE label = ?", (label,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def events(self, bucket_id=None, start=None, end=None, tag=None, limit=None):
+        """
+            Returns stored events ordered by timestamp, optionally only those in a bucket,
+            in the time range [start, end) (datetimes or Zenobase timestamp strings) or
+            having the given tag.
+        """
+        query, params = ["SELECT data FROM events"], []
+        conditions = []
+        if tag is not None:
+            query.append("JOIN event_tags ON event_tags.event_rowid = events.rowid")
+            conditions.append("event_tags.tag = ?")
+            params.append(tag)
+        if bucket_id is not None:
+            conditions.append("events.bucket_id = ?")
+            params.append(bucket_id)
+        if start is not None:
+            conditions.append("events.timestamp >= ?")
+            params.append(_to_epoch(start))
+        if end is not None:
+            conditions.append("events.timestamp < ?")
+            params.append(_to_epoch(end))
+        if conditions:
+            query.append("WHERE " + " AND ".join(conditions))
+        query.append("ORDER BY events.timestamp")
+        if limit is not None:
+            query.append("LIMIT ?")
+            params.append(limit)
+
+        with self._lock:
+            return [json.loads(data) for (data,) in self._conn.execute(" ".join(query), params)]
+
+    def count(self, bucket_id=None):
+        with self._lock:
+            if bucket_id is None:
+                return self._conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM events WHERE bucket_id = ?", (bucket_id,)).fetchone()[0]
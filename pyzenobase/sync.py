@@ -0,0 +1,48 @@
+import os
+import json
+import threading
+
+from pyzenobase import fmt_datetime, parse_datetime
+
+
+class SyncState:
+    """
+        Keeps the high-water mark (latest uploaded timestamp) of each bucket, or of
+        each tagged stream of events in a bucket, used by ZenobaseAPI.sync_events.
+
+        If path is given the marks are persisted to that JSON file on every update
+        so that they survive between runs, otherwise they are only kept in memory.
+    """
+
+    def __init__(self, path=None):
+        self.path = os.path.expanduser(path) if path is not None else None
+        self._marks = {}
+        self._lock = threading.Lock()
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path) as f:
+                self._marks = {bucket_id: parse_datetime(ts) for bucket_id, ts in json.load(f).items()}
+
+    def get(self, bucket_id):
+        with self._lock:
+            return self._marks.get(bucket_id)
+
+    def set(self, bucket_id, dt):
+        with self._lock:
+            self._marks[bucket_id] = dt
+            self._save()
+
+    def forget(self, bucket_id):
+        """Forgets the mark of the bucket and those of its tagged streams"""
+        with self._lock:
+            for key in [key for key in self._marks if key == bucket_id or key.startswith(bucket_id + " ")]:
+                del self._marks[key]
+            self._save()
+
+    def _save(self):
+        if self.path is None:
+            return
+        # Write to a temporary file first so a crash never leaves a half-written state file
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({bucket_id: fmt_datetime(dt, timezone="UTC") for bucket_id, dt in self._marks.items()}, f)
+        os.replace(tmp_path, self.path)
@@ -1,15 +1,25 @@
 #!/usr/bin/python3
 
+import io
+import os
 import time
+import asyncio
+import tempfile
 import json
 from pprint import pprint
+from concurrent.futures import ThreadPoolExecutor
 import unittest
+from unittest import mock
 from random import randint
 import requests
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 import pyzenobase
 from pyzenobase import *
+from pyzenobase.mock_server import MockZenobaseServer
+from pyzenobase.ingest import ColumnMapping, ingest_csv
+from pyzenobase.dump import dump
+from pyzenobase.async_zenobase_api import aiohttp
 
 class ZenobaseTests(unittest.TestCase):
     def setUp(self):
@@ -76,6 +86,426 @@ class ZenobaseTests(unittest.TestCase):
         self.zapi.close()
 
 
+class EventTests(unittest.TestCase):
+    def test_compact_event(self):
+        data = {"timestamp": datetime.now(), "tag": ["a", "b"], "weight": {"@value": 3, "unit": "mcg"}}
+        event = ZenobaseEvent(dict(data, weight=dict(data["weight"])))
+        compact_event = CompactZenobaseEvent(data)
+        self.assertEqual(compact_event, event)
+        self.assertEqual(json.dumps(compact_event, default=pyzenobase.zenobase_event.json_default), json.dumps(event))
+
+    def test_event_batch(self):
+        batch = EventBatch(timestamp=["2015-06-01 12:00:00", "2015-06-01 12:05:00"],
+                           timestamp_format="%Y-%m-%d %H:%M:%S", timezone="Europe/Stockholm",
+                           tag="battery", percentage=["55", "54"], weight=(["1", "2"], "mcg"))
+        events = [ZenobaseEvent({"timestamp": pyzenobase.fmt_datetime(datetime(2015, 6, 1, 12, 5 * i),
+                                                                      timezone="Europe/Stockholm"),
+                                 "tag": "battery", "percentage": 55.0 - i,
+                                 "weight": {"@value": 1.0 + i, "unit": "mcg"}}) for i in range(2)]
+        self.assertEqual(list(batch), events)
+        self.assertEqual(list(batch.iter_json_batches()), [json.dumps({"events": events})])
+        self.assertEqual(list(EventBatch(timestamp="2015-06-01T12:00:00.000+0200", count=["", "2"])),
+                         [{"timestamp": "2015-06-01T12:00:00.000+0200"},
+                          {"timestamp": "2015-06-01T12:00:00.000+0200", "count": 2}])
+        # Timestamps used for all events are parsed and formatted like columns
+        stamp = pyzenobase.fmt_datetime(datetime(2015, 6, 1, 12), timezone="Europe/Stockholm")
+        self.assertEqual([event["timestamp"] for event in EventBatch(timestamp="2015-06-01 12:00:00",
+                                                                     timestamp_format="%Y-%m-%d %H:%M:%S",
+                                                                     timezone="Europe/Stockholm", count=[1, 2])],
+                         [stamp, stamp])
+        self.assertEqual(list(EventBatch(timestamp=datetime(2015, 6, 1, 12), timezone="Europe/Stockholm")),
+                         [{"timestamp": stamp}])
+        # Values that NumPy would accept but that don't match the format are rejected
+        with self.assertRaises(ValueError):
+            EventBatch(timestamp=["2015-06-01"], timestamp_format="%Y-%m-%d %H:%M:%S")
+
+    def test_invalid_field(self):
+        with self.assertRaises(AssertionError):
+            ZenobaseEvent({"not_a_field": 1})
+        ZenobaseEvent({"@id": "abc", "count": 1}, trusted=True)
+
+
+class UtilTests(unittest.TestCase):
+    def test_iter_batches(self):
+        batches = list(pyzenobase.iter_batches(range(10), batch_size=4))
+        self.assertEqual(batches, [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+
+        batches = list(pyzenobase.iter_batches(["aaa", "b", "cc", "dddddd"], max_bytes=4))
+        self.assertEqual(batches, [["aaa", "b"], ["cc"], ["dddddd"]])
+
+
+    def test_parse_datetime(self):
+        dt = datetime(2015, 6, 1, 12, 30, tzinfo=timezone.utc)
+        self.assertEqual(pyzenobase.parse_datetime(pyzenobase.fmt_datetime(dt, timezone="Europe/Stockholm")), dt)
+        self.assertEqual(pyzenobase.parse_datetime("2015-06-01T14:30:00+02:00"), dt)
+
+    def test_fmt_datetimes(self):
+        # Includes the hours around the start and end of daylight saving time
+        dts = [datetime(2015, 3, 29, 1, 30) + i * timedelta(minutes=20) for i in range(10)] + \
+              [datetime(2015, 10, 25, 1, 30) + i * timedelta(minutes=20) for i in range(10)] + \
+              [datetime(2015, 6, 1, 12, tzinfo=timezone.utc)]
+        self.assertEqual(pyzenobase.fmt_datetimes(dts, timezone="Europe/Stockholm"),
+                         [pyzenobase.fmt_datetime(dt, timezone="Europe/Stockholm") for dt in dts])
+        self.assertEqual(pyzenobase.fmt_datetime(datetime(2015, 6, 1, 12), timezone="Europe/Stockholm"),
+                         "2015-06-01T12:00:00.000+0200")
+
+    def test_aggregate(self):
+        from pyzenobase.aggregate import aggregate
+        events = [{"timestamp": "2015-06-01T08:00:00.000+0200", "tag": "coffee", "weight": {"@value": 100, "unit": "mg"}},
+                  {"timestamp": "2015-06-01T20:00:00.000+0200", "tag": "coffee", "weight": {"@value": 0.2, "unit": "g"}},
+                  {"timestamp": "2015-06-02T08:00:00.000+0200", "tag": "coffee", "weight": {"@value": 300, "unit": "mg"}}]
+        rows = aggregate(events, "weight", by="day", percentiles=(50,))
+        self.assertEqual([(row["period"], row["count"]) for row in rows],
+                         [(datetime(2015, 6, 1), 2), (datetime(2015, 6, 2), 1)])
+        self.assertAlmostEqual(rows[0]["sum"], 0.3)
+        self.assertAlmostEqual(rows[0]["p50"], 0.15)
+        rows = aggregate(events, "weight", by="day", timezone="Pacific/Auckland")
+        self.assertEqual([(row["period"], row["count"]) for row in rows],
+                         [(datetime(2015, 6, 1), 1), (datetime(2015, 6, 2), 2)])
+
+        # Without pytz's transition table every time is converted on its own, with the same result
+        start = datetime(2015, 4, 4, tzinfo=timezone.utc)
+        events = [{"timestamp": fmt_datetime(start + timedelta(hours=5 * i)), "count": 1} for i in range(1000)]
+        rows = aggregate(events, "count", by="hour", timezone="Pacific/Auckland")
+        with mock.patch("pyzenobase.aggregate._transitions", return_value=None) as transitions:
+            self.assertEqual(aggregate(events, "count", by="hour", timezone="Pacific/Auckland"), rows)
+        self.assertTrue(transitions.called)
+
+    def test_dedup_index(self):
+        index = pyzenobase.DedupIndex(merge_threshold=10)
+        index.add_all(range(100))
+        index.add_all(range(50, 150))
+        self.assertEqual(len(index), 150)
+        self.assertIn(149, index)
+        self.assertNotIn(150, index)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bucket.hashes")
+            index = pyzenobase.DedupIndex(path, merge_threshold=10)
+            index.add_all(range(100, 0, -1))
+            index.add_all(range(150, 200))
+            index = pyzenobase.DedupIndex(path)
+            self.assertEqual((len(index), 1 in index, 199 in index, 0 in index), (150, True, True, False))
+        self.assertEqual(pyzenobase.event_hash({"count": 1, "tag": "a"}),
+                         pyzenobase.event_hash({"tag": "a", "count": 1}))
+
+    def test_memory_cache(self):
+        # Caches must implement get, set and invalidate
+        with self.assertRaises(TypeError):
+            pyzenobase.ResponseCache()
+        cache = pyzenobase.MemoryCache(max_entries=2)
+        for key in ["/buckets/a", "/buckets/a/?offset=0", "/buckets/ab"]:
+            cache.set(key, {"content": key})
+        self.assertIsNone(cache.get("/buckets/a"))
+        cache.invalidate(prefixes=["/buckets/a/", "/buckets/a?"], keys=["/buckets/a"])
+        self.assertIsNone(cache.get("/buckets/a/?offset=0"))
+        self.assertIsNotNone(cache.get("/buckets/ab"))
+
+    def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = pyzenobase.DiskCache(directory)
+            long_key = "/buckets/a/?q=" + "x" * 500
+            for key in ["/buckets/a", "/buckets/a/?offset=0", "/buckets/ab", long_key, "/users/u/buckets/"]:
+                cache.set(key, {"content": key})
+            self.assertEqual(cache.get(long_key), {"content": long_key, "key": long_key})
+            cache.invalidate(prefixes=["/buckets/a/", "/buckets/a?"], keys=["/buckets/a"])
+            self.assertEqual([key for key in ["/buckets/a", "/buckets/a/?offset=0", "/buckets/ab", long_key]
+                              if cache.get(key) is not None], ["/buckets/ab"])
+            cache.clear()
+            self.assertEqual(os.listdir(directory), [])
+
+
+class MockServerTests(unittest.TestCase):
+    def setUp(self):
+        self.server = MockZenobaseServer().start()
+        self.zapi = ZenobaseAPI("test", "test", host=self.server.url)
+
+    def tearDown(self):
+        self.zapi.close()
+        self.server.stop()
+
+    def test_create_and_iter_events(self):
+        bucket = self.zapi.create_or_get_bucket("Test")
+        start = datetime(2016, 1, 1, tzinfo=timezone.utc)
+        events = [{"timestamp": fmt_datetime(start + timedelta(hours=i)), "count": i} for i in range(250)]
+        self.zapi.create_events(bucket, events, batch_size=100)
+        self.assertEqual([event["count"] for event in self.zapi.iter_events(bucket, page_size=100)], list(range(250)))
+        self.assertEqual(self.zapi.get_latest_timestamp(bucket), start + timedelta(hours=249))
+
+        # Streamed bodies are sent with chunked transfer encoding
+        with ZenobaseAPI("test", "test", host=self.server.url, stream_chunk_size=1024) as zapi:
+            zapi.create_events(bucket, events[:50])
+        self.assertEqual(len(list(self.zapi.iter_events(bucket))), 300)
+
+    def test_compression(self):
+        bucket = self.zapi.create_bucket("Test")
+        events = [{"timestamp": fmt_datetime(datetime(2016, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=i)),
+                   "tag": "compressed", "count": i} for i in range(200)]
+        with ZenobaseAPI("test", "test", host=self.server.url, compress_threshold=1024) as zapi:
+            zapi.create_events(bucket, events[:100])
+            self.assertEqual(self.server.content_encodings.get("gzip"), 1)
+            # Bodies below the threshold are sent as they are
+            zapi.create_event(bucket, events[100])
+            self.assertEqual(self.server.content_encodings.get("gzip"), 1)
+            zapi.create_events(bucket, events[101:], batch_size=50)
+            self.assertEqual(self.server.content_encodings.get("gzip"), 3)
+        stored = list(self.zapi.iter_events(bucket))
+        self.assertEqual([{key: event[key] for key in ["timestamp", "tag", "count"]} for event in stored],
+                         events)
+
+    def test_bulk_delete(self):
+        buckets = [self.zapi.create_bucket("Test{}".format(i)) for i in range(5)]
+        results = self.zapi.delete_buckets(buckets + ["missing"], raise_on_error=False)
+        self.assertEqual([result.error is None for result in results], [True] * 5 + [False])
+        self.assertEqual(self.zapi.list_buckets()["total"], 0)
+        self.assertRaises(ValueError, self.zapi.list_buckets, limit=0)
+
+    def test_metrics(self):
+        metrics = Metrics()
+        self.zapi.add_observer(metrics)
+        bucket = self.zapi.create_bucket("Test")
+        self.zapi.create_events(bucket, [{"count": i} for i in range(10)], batch_size=5)
+        stats = metrics.snapshot()["POST /buckets/{bucket}/"]
+        self.assertEqual((stats["requests"], stats["events"], stats["status_codes"]), (2, 10, {201: 2}))
+        self.assertIn('pyzenobase_events_total{method="POST",route="/buckets/{bucket}/"} 10', metrics.to_prometheus())
+
+        # Fresh cache hits (of responses without an ETag) are counted as cached 200s rather than errors
+        cache = MemoryCache()
+        endpoint = "/buckets/{}".format(bucket["@id"])
+        cache.set(endpoint, {"content": json.dumps(bucket), "is_json": True, "etag": None,
+                             "last_modified": None, "stored_at": time.time()})
+        with ZenobaseAPI("test", "test", host=self.server.url, cache=cache, observers=[metrics]) as zapi:
+            self.assertEqual(zapi.get_bucket(bucket["@id"]), bucket)
+        stats = metrics.snapshot()["GET /buckets/{bucket}"]
+        self.assertEqual((stats["requests"], stats["cached"], stats["errors"], stats["status_codes"]),
+                         (1, 1, 0, {200: 1}))
+
+    def test_ingest_csv(self):
+        bucket = self.zapi.create_bucket("Test")
+        csvfile = io.StringIO("time,level,temperature\n" +
+                              "".join("2016-01-01 00:{:02d}:00,{},20\n".format(i, i if i % 2 else "") for i in range(25)))
+        mapping = ColumnMapping(timestamp="time", timestamp_format="%Y-%m-%d %H:%M:%S", timezone="UTC",
+                                fields={"percentage": "level", "temperature": ("temperature", "C")}, tags=["test"])
+        ingest_csv(self.zapi, bucket, csvfile, mapping, chunk_size=10, batch_size=5)
+        events = list(self.zapi.iter_events(bucket))
+        self.assertEqual(len(events), 25)
+        self.assertEqual(events[1]["timestamp"], "2016-01-01T00:01:00.000+0000")
+        self.assertEqual((events[1]["percentage"], events[1]["tag"]), (1.0, ["test"]))
+        self.assertNotIn("percentage", events[2])
+
+    def test_sync_events_tags(self):
+        bucket = self.zapi.create_bucket("Test")
+        start = datetime(2016, 1, 1, tzinfo=timezone.utc)
+
+        def events(tag, hours):
+            return [{"timestamp": fmt_datetime(start + timedelta(hours=i)), "tag": [tag]} for i in hours]
+        self.zapi.sync_events(bucket, events("daily", range(150)), tag="daily")
+        # The timestamped stream is behind the daily one but has a mark of its own
+        self.zapi.sync_events(bucket, events("timestamped", range(5)), tag="timestamped")
+        self.assertEqual(self.zapi.get_latest_timestamp(bucket, tag="timestamped"), start + timedelta(hours=4))
+        self.zapi.sync_events(bucket, events("timestamped", range(8)), tag="timestamped")
+        self.assertEqual(len(list(self.zapi.iter_events(bucket))), 158)
+        self.assertEqual(len(list(self.zapi.iter_events(bucket, q="tag:timestamped"))), 8)
+
+        # Without a stored mark the server is asked for the latest tagged event, not paged through
+        metrics = Metrics()
+        with ZenobaseAPI("test", "test", host=self.server.url, observers=[metrics]) as zapi:
+            zapi.sync_events(bucket, events("timestamped", range(9)), tag="timestamped")
+        self.assertEqual(metrics.snapshot()["GET /buckets/{bucket}/"]["requests"], 1)
+        self.assertEqual(len(list(self.zapi.iter_events(bucket, q="tag:timestamped"))), 9)
+
+    def test_dump_separate(self):
+        # Duplicate labels and labels like those of the other files get files of their own
+        for label in ["events", "buckets", "Test", "Test"]:
+            self.zapi.create_events(self.zapi.create_bucket(label), [{"count": 1}])
+        with tempfile.TemporaryDirectory() as output_dir:
+            dump(self.zapi, output_dir, username="test", separate=True, progress=False)
+            self.assertEqual(len(os.listdir(output_dir)), 5)
+
+    @unittest.skipIf(aiohttp is None, "requires aiohttp")
+    def test_async_buckets(self):
+        for i in range(150):
+            self.zapi.create_bucket("Test{:03d}".format(i))
+
+        async def run():
+            async with AsyncZenobaseAPI("test", "test", host=self.server.url) as zapi:
+                self.assertEqual(len((await zapi.list_buckets(limit=None))["buckets"]), 150)
+                bucket = await zapi.create_or_get_bucket("Test149")
+                buckets = await asyncio.gather(*[zapi.create_or_get_bucket("New") for _ in range(5)])
+                self.assertEqual(len({bucket["@id"] for bucket in buckets}), 1)
+                return bucket
+        self.assertEqual(asyncio.run(run())["label"], "Test149")
+        self.assertEqual(self.zapi.list_buckets()["total"], 151)
+
+    @unittest.skipIf(aiohttp is None, "requires aiohttp")
+    def test_async_errors(self):
+        async def run():
+            retry = RetryPolicy(max_retries=2, backoff_factor=0.001)
+            async with AsyncZenobaseAPI("test", "test", host=self.server.url, retry=retry) as zapi:
+                with self.assertRaises(ZenobaseAPIError) as cm:
+                    await zapi.get_bucket("missing")
+                self.assertEqual(cm.exception.status_code, 404)
+
+                # Failed requests are retried, then raise
+                self.server.error_rate = 1
+                requests_before = self.server.request_count
+                with self.assertRaises(ZenobaseAPIError) as cm:
+                    await zapi.list_buckets()
+                self.assertEqual((cm.exception.status_code, self.server.request_count - requests_before), (503, 3))
+                self.server.error_rate = 0
+
+                # Requests rejected with a revoked token log in again, once for all of them
+                self.server.tokens.clear()
+                pages = await asyncio.gather(*[zapi.list_buckets() for _ in range(5)])
+                self.assertEqual([page["total"] for page in pages], [0] * 5)
+                self.assertEqual(list(self.server.tokens), [zapi.access_token])
+        asyncio.run(run())
+
+    def test_retry(self):
+        metrics = Metrics()
+        retry = RetryPolicy(max_retries=10, backoff_factor=0.001)
+        with MockZenobaseServer(error_rate=0.3, seed=1) as server:
+            # Logging in is retried too
+            with ZenobaseAPI("test", "test", host=server.url, retry=retry, observers=[metrics]) as zapi:
+                for _ in range(20):
+                    self.assertEqual(zapi.list_buckets()["total"], 0)
+                server.error_rate = 1
+                with self.assertRaises(ZenobaseAPIError):
+                    zapi.create_bucket("Test")
+                server.error_rate = 0
+        stats = metrics.snapshot()
+        self.assertGreater(stats["POST /oauth/token"]["retries"], 0)
+        self.assertGreater(stats["GET /users/{user}/buckets/"]["retries"], 0)
+        # POSTs aren't retried, they may have been processed
+        self.assertEqual(stats["POST /buckets/"]["retries"], 0)
+        self.assertEqual(RetryPolicy(max_backoff=1).backoff(0, retry_after=3600), 1)
+
+    def test_rate_limiter(self):
+        self.zapi.rate_limiter = RateLimiter(rate=50, burst=1)
+        started = time.monotonic()
+        for _ in range(11):
+            self.zapi.list_buckets()
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+
+    def test_token_store(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                MockZenobaseServer(credentials={"test": "test"}) as server:
+            store = TokenStore(os.path.join(directory, "tokens.json"))
+
+            def client(password="test"):
+                return ZenobaseAPI("test", password, host=server.url, token_store=store)
+            with client() as zapi:
+                # A second client (or process) reuses the stored token instead of logging in
+                with client() as other:
+                    self.assertEqual(other.access_token, zapi.access_token)
+                self.assertEqual(len(server.tokens), 1)
+                with self.assertRaises(ZenobaseAPIError):
+                    client("wrong")
+
+                # Keys are an HMAC with a secret kept next to the store, readable by its owner only
+                self.assertEqual(os.stat(store.path + ".key").st_mode & 0o777, 0o600)
+                other_store = TokenStore(os.path.join(directory, "other.json"))
+                self.assertNotEqual(store.credentials_key("test", "test"), other_store.credentials_key("test", "test"))
+                self.assertEqual(store.credentials_key("test", "test"),
+                                 TokenStore(store.path).credentials_key("test", "test"))
+
+                # A token revoked elsewhere gets a 401, after which a new one is fetched and stored
+                server.tokens.clear()
+                self.assertEqual(zapi.list_buckets()["total"], 0)
+                self.assertEqual(list(server.tokens), [zapi.access_token])
+                with client() as other:
+                    self.assertEqual(other.access_token, zapi.access_token)
+
+    def test_token_expiry(self):
+        with MockZenobaseServer(token_ttl=1) as server, ZenobaseAPI("test", "test", host=server.url) as zapi:
+            time.sleep(1.1)
+            self.assertEqual(zapi.list_buckets()["total"], 0)
+            self.assertEqual(len(server.tokens), 2)
+
+        # A token living shorter than the expiry margin is still reused until halfway through its lifetime
+        with MockZenobaseServer(token_ttl=30) as server, ZenobaseAPI("test", "test", host=server.url) as zapi:
+            for _ in range(3):
+                zapi.list_buckets()
+            self.assertEqual(len(server.tokens), 1)
+
+        # Concurrent requests rejected with the same token all reuse a single replacement,
+        # including those rejected after it was fetched
+        def list_buckets(i):
+            time.sleep(i * 0.02)
+            return zapi.list_buckets()
+        with MockZenobaseServer(latency=0.05) as server, ZenobaseAPI("test", "test", host=server.url) as zapi:
+            server.tokens.clear()
+            with ThreadPoolExecutor(8) as executor:
+                list(executor.map(list_buckets, range(8)))
+            self.assertEqual(len(server.tokens), 1)
+
+    def test_local_store(self):
+        bucket = self.zapi.create_bucket("Test")
+        start = datetime(2016, 1, 1, tzinfo=timezone.utc)
+
+        def events(hours):
+            return [{"timestamp": fmt_datetime(start + timedelta(hours=i)), "tag": ["a", "b"][i % 2], "count": i}
+                    for i in hours]
+        self.zapi.create_events(bucket, events(range(10)))
+        with LocalStore() as store:
+            store.sync(self.zapi, page_size=4)
+            self.assertEqual([b["label"] for b in store.buckets()], ["Test"])
+            self.assertEqual(store.count(bucket["@id"]), 10)
+
+            # Only events at or after the latest stored timestamp are fetched again
+            self.zapi.create_events(bucket, events(range(10, 15)))
+            self.assertEqual(store.sync_bucket(self.zapi, bucket["@id"], page_size=4), 6)
+            self.assertEqual(store.count(bucket["@id"]), 15)
+            self.assertEqual([e["count"] for e in store.events(bucket["@id"], tag="a")], list(range(0, 15, 2)))
+            self.assertEqual([e["count"] for e in store.events(bucket["@id"], start=start + timedelta(hours=3),
+                                                               end=fmt_datetime(start + timedelta(hours=6)))],
+                             [3, 4, 5])
+
+            # Deletions are only picked up by a full sync
+            event_id = store.events(bucket["@id"], limit=1)[0]["@id"]
+            self.zapi.delete_event(bucket, event_id)
+            store.sync_bucket(self.zapi, bucket["@id"])
+            self.assertEqual(store.count(bucket["@id"]), 15)
+            self.assertEqual(store.sync_bucket(self.zapi, bucket["@id"], full=True), 14)
+            self.assertEqual(store.count(bucket["@id"]), 14)
+
+            # A full sync failing halfway through the download leaves the stored events as they were
+            self.zapi.delete_event(bucket, store.events(bucket["@id"], limit=1)[0]["@id"])
+            stored = store.events(bucket["@id"])
+            iter_events = self.zapi.iter_events
+
+            def failing_iter_events(*args, **kwargs):
+                for i, event in enumerate(iter_events(*args, **kwargs)):
+                    if i == 6:
+                        raise requests.ConnectionError("Connection lost")
+                    yield event
+            self.zapi.iter_events = failing_iter_events
+            with self.assertRaises(requests.ConnectionError):
+                store.sync_bucket(self.zapi, bucket["@id"], full=True, page_size=4)
+            self.assertEqual(store.events(bucket["@id"]), stored)
+            self.zapi.iter_events = iter_events
+            self.assertEqual(store.sync_bucket(self.zapi, bucket["@id"], full=True), 13)
+            self.assertEqual(store.count(bucket["@id"]), 13)
+
+    def test_journal_resume(self):
+        bucket = self.zapi.create_bucket("Test")
+        events = [{"count": i} for i in range(100)]
+        with tempfile.TemporaryDirectory() as directory:
+            journal = UploadJournal(os.path.join(directory, "journal.ndjson"))
+            self.server.error_rate = 0.5
+            self.server.random.seed(1)
+            results = self.zapi.create_events(bucket, events, batch_size=10, max_workers=1, raise_on_error=False,
+                                              journal=journal, source="test")
+            failed = sum(result.count for result in results if result.error is not None)
+            self.assertTrue(0 < failed < 100)
+
+            # Resuming with a reloaded journal uploads exactly the events of the failed batches
+            self.server.error_rate = 0
+            results = self.zapi.create_events(bucket, events, batch_size=10, journal=UploadJournal(journal.path),
+                                              source="test")
+            self.assertEqual(sum(result.count for result in results), failed)
+        self.assertEqual(sorted(event["count"] for event in self.zapi.iter_events(bucket)), list(range(100)))
+
+
 class ExampleTest(unittest.TestCase):
     def testExample(self):
         with ZenobaseAPI() as zapi:
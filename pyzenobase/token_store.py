@@ -0,0 +1,121 @@
+import os
+import hmac
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where the store is only locked within the process
+    fcntl = None
+
+
+class TokenStore:
+    """
+        Keeps OAuth access tokens in a JSON file so that processes using the same
+        credentials can share one token instead of logging in (and revoking the token)
+        every time, see ZenobaseAPI(token_store=...).
+
+        The file is locked (with flock) while a process reads, refreshes or writes it,
+        so concurrent processes wait for each other rather than all logging in at once.
+        It holds credentials, so it is created readable by its owner only.
+
+        Tokens are keyed by an HMAC of the credentials, so that a wrong password never gets
+        a stored token. Its secret is generated per store and kept in a .key file next to it.
+    """
+
+    # Tokens this close to expiring (or halfway to expiring, if that's sooner) are treated as expired
+    EXPIRY_MARGIN = 60
+
+    def __init__(self, path="~/.pyzenobase-tokens.json"):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._secret = None
+
+    @contextmanager
+    def lock(self):
+        """Locks the store for this thread and, through a .lock file, other processes. Reentrant."""
+        with self._lock:
+            # flock locks taken on separate descriptors exclude each other even within a process
+            if fcntl is None or self._depth:
+                self._depth += 1
+                try:
+                    yield
+                finally:
+                    self._depth -= 1
+                return
+            fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+            self._depth += 1
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                self._depth -= 1
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+    def _load_secret(self):
+        key_path = self.path + ".key"
+        with self.lock():
+            try:
+                with open(key_path, "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                secret = os.urandom(32)
+                with os.fdopen(os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as f:
+                    f.write(secret)
+                return secret
+
+    def credentials_key(self, *credentials):
+        """Returns an HMAC of the credentials to use as part of a token key"""
+        if self._secret is None:
+            self._secret = self._load_secret()
+        message = "\0".join(credentials).encode("utf-8")
+        return hmac.new(self._secret, message, hashlib.sha256).hexdigest()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self, tokens):
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            json.dump(tokens, f)
+        os.replace(tmp_path, self.path)
+
+    @classmethod
+    def refresh_at(cls, token):
+        """When the token should be replaced, None if it doesn't expire"""
+        if token.get("refresh_at") is not None:
+            return token["refresh_at"]
+        return token["expires_at"] - cls.EXPIRY_MARGIN if token.get("expires_at") is not None else None
+
+    def get(self, key):
+        """Returns the stored token dict (access_token, client_id, expires_at, refresh_at) if it is still valid"""
+        with self.lock():
+            token = self._load().get(key)
+        if token is None:
+            return None
+        refresh_at = self.refresh_at(token)
+        if refresh_at is not None and refresh_at < time.time():
+            return None
+        return token
+
+    def set(self, key, token):
+        with self.lock():
+            tokens = self._load()
+            tokens[key] = token
+            self._save(tokens)
+
+    def forget(self, key):
+        with self.lock():
+            tokens = self._load()
+            if tokens.pop(key, None) is not None:
+                self._save(tokens)
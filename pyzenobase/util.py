@@ -1,8 +1,142 @@
-import pytz
-from tzlocal import get_localzone
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import islice
 
+__all__ = ["fmt_datetime", "fmt_datetimes", "parse_datetime", "iter_batches", "bounded_map"]
 
-def fmt_datetime(dt, timezone=str(get_localzone())):
-    tz = pytz.timezone(timezone)
-    dt = dt.astimezone(tz) if dt.tzinfo else tz.localize(dt)
-    return dt.strftime('%Y-%m-%dT%H:%M:%S.000%z')
+
+@lru_cache(maxsize=None)
+def _get_timezone(timezone):
+    """Returns the pytz timezone with the given name, the local timezone if None"""
+    # Imported here (once per timezone) since importing them is slow and many uses never format a datetime
+    import pytz
+    from tzlocal import get_localzone
+    return pytz.timezone(timezone if timezone is not None else str(get_localzone()))
+
+
+@lru_cache(maxsize=1024)
+def _fmt_utcoffset(offset):
+    """Same as strftime's %z"""
+    seconds = int(offset.total_seconds())
+    sign = "-" if seconds < 0 else "+"
+    hours, seconds = divmod(abs(seconds), 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if seconds:
+        return "%s%02d%02d%02d" % (sign, hours, minutes, seconds)
+    return "%s%02d%02d" % (sign, hours, minutes)
+
+
+def _fmt_aware(dt):
+    if dt.year < 1000:
+        # strftime doesn't zero-pad years before 1000
+        return dt.strftime('%Y-%m-%dT%H:%M:%S.000%z')
+    return "%04d-%02d-%02dT%02d:%02d:%02d.000%s" % (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second,
+                                                     _fmt_utcoffset(dt.utcoffset()))
+
+
+def fmt_datetime(dt, timezone=None):
+    """
+        Formats dt the way Zenobase wants it, naive datetimes are interpreted as
+        local time in timezone (the local timezone if None), aware ones are converted.
+    """
+    tz = _get_timezone(timezone)
+    if dt.tzinfo is not None:
+        return _fmt_aware(dt.astimezone(tz))
+    return _fmt_naive(dt, tz)
+
+
+@lru_cache(maxsize=4096)
+def _hour_utcoffset(tz, hour):
+    """Returns the formatted UTC offset of tz during the naive hour, or None if it changes within it"""
+    start = tz.localize(hour).utcoffset()
+    end = tz.localize(hour + timedelta(minutes=59, seconds=59, microseconds=999999)).utcoffset()
+    return _fmt_utcoffset(start) if start == end else None
+
+
+def _fmt_naive(dt, tz):
+    # Localizing is by far the most expensive part of formatting, so use the
+    # cached offset of the hour unless the offset changes during that hour.
+    offset = _hour_utcoffset(tz, dt.replace(minute=0, second=0, microsecond=0)) if dt.year >= 1000 else None
+    if offset is None:
+        return _fmt_aware(tz.localize(dt))
+    return "%04d-%02d-%02dT%02d:%02d:%02d.000%s" % (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second, offset)
+
+
+def fmt_datetimes(datetimes, timezone=None):
+    """
+        Formats a whole column of datetimes at once, returns a list with the same
+        output as calling fmt_datetime on each element.
+
+        datetimes can be any iterable of datetimes or a NumPy datetime64 array, whose
+        (naive) values are interpreted like naive datetimes: as local time in timezone.
+        NumPy arrays are formatted in a single vectorised pass.
+    """
+    tz = _get_timezone(timezone)
+    if getattr(datetimes, "dtype", None) is not None and datetimes.dtype.kind == "M":
+        return _fmt_datetime64s(datetimes, tz)
+    return [_fmt_aware(dt.astimezone(tz)) if dt.tzinfo is not None else _fmt_naive(dt, tz) for dt in datetimes]
+
+
+def _fmt_datetime64s(datetimes, tz):
+    import numpy as np
+
+    datetimes = np.asarray(datetimes).ravel()
+    hours, inverse = np.unique(datetimes.astype("datetime64[h]"), return_inverse=True)
+    offsets = np.array([_hour_utcoffset(tz, hour) or "" for hour in hours.astype(datetime)], dtype=object)
+    formatted = np.char.add(np.datetime_as_string(datetimes, unit="s"), ".000").astype(object) + offsets[inverse]
+
+    # Fall back to formatting one at a time in the rare hours where the offset changes
+    # and for years that need the same formatting as strftime
+    for i in np.flatnonzero((offsets[inverse] == "") | (datetimes < np.datetime64("1000-01-01"))):
+        formatted[i] = fmt_datetime(datetimes[i].astype("datetime64[us]").astype(datetime), tz.zone)
+    return formatted.tolist()
+
+
+def parse_datetime(s):
+    """Parses a timestamp as formatted by fmt_datetime or returned by Zenobase into an aware datetime"""
+    try:
+        return datetime.strptime(s, '%Y-%m-%dT%H:%M:%S.%f%z')
+    except ValueError:
+        return datetime.strptime(s, '%Y-%m-%dT%H:%M:%S%z')
+
+
+def iter_batches(items, batch_size=None, max_bytes=None, size=len):
+    """
+        Lazily splits items into lists of at most batch_size items whose total size
+        (as given by size) does not exceed max_bytes. An item that alone is larger
+        than max_bytes is put in a batch of its own.
+    """
+    batch, batch_bytes = [], 0
+    for item in items:
+        item_bytes = size(item) if max_bytes is not None else 0
+        if batch and ((batch_size is not None and len(batch) >= batch_size) or
+                      (max_bytes is not None and batch_bytes + item_bytes > max_bytes)):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(item)
+        batch_bytes += item_bytes
+    if batch:
+        yield batch
+
+
+def bounded_map(fn, items, max_workers=4):
+    """
+        Calls fn on every item in a thread pool, keeping at most max_workers calls
+        in flight and only pulling new items from the iterable as calls complete.
+
+        Yields (item, result, exception) tuples in order of completion.
+    """
+    # Imported here since concurrent.futures (through logging) is slow to import
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(fn, item): item for item in islice(items, max_workers)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                exception = future.exception()
+                yield item, (future.result() if exception is None else None), exception
+            for item in islice(items, len(done)):
+                pending[executor.submit(fn, item)] = item
@@ -1,6 +1,69 @@
+import re
+import gzip
 import json
+import time
+import threading
+from datetime import datetime
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count, islice
+from urllib.parse import quote
+
 import requests
-from pyzenobase import ZenobaseEvent
+from requests.adapters import HTTPAdapter
+from pyzenobase import CompactZenobaseEvent, SyncState, RetryPolicy, TokenStore, event_hash, fmt_datetime, \
+    parse_datetime, iter_batches, bounded_map
+from pyzenobase.metrics import RequestInfo
+from pyzenobase.encoding import dumps, EventsBody, GzipBody, EVENTS_PREFIX, EVENTS_SUFFIX, EVENTS_SEPARATOR
+
+
+# Matches the bucket id of endpoints such as /buckets/{id}, /buckets/{id}/ and /buckets/{id}/?offset=0
+_BUCKET_ENDPOINT_RE = re.compile(r"^/buckets/([^/?]+)")
+
+class _CountingBody:
+    """Re-iterable wrapper of a streamed request body that counts the bytes sent"""
+
+    def __init__(self, body):
+        self.body = body
+        self.bytes = 0
+
+    def __iter__(self):
+        self.bytes = 0
+        for chunk in self.body:
+            self.bytes += len(chunk)
+            yield chunk
+
+
+BatchResult = namedtuple("BatchResult", ["index", "count", "response", "error"])
+
+DeleteResult = namedtuple("DeleteResult", ["id", "error"])
+
+
+class ZenobaseAPIError(Exception):
+    """Raised when a request got a non-2xx response (after any retries)"""
+    def __init__(self, response):
+        self.response = response
+        # A requests response, or an aiohttp one (from AsyncZenobaseAPI) which has status instead
+        self.status_code = response.status_code if hasattr(response, "status_code") else response.status
+        super(ZenobaseAPIError, self).__init__("Status code was not 2xx: {}".format(self.status_code))
+
+
+class BatchUploadError(Exception):
+    """Raised by create_events when one or more batches failed, results holds all BatchResults"""
+    def __init__(self, results):
+        self.results = results
+        failed = [result for result in results if result.error is not None]
+        super(BatchUploadError, self).__init__(
+            "{} of {} batches failed, first error: {}".format(len(failed), len(results), failed[0].error))
+
+
+class BulkDeleteError(Exception):
+    """Raised by delete_buckets and delete_events when some deletions failed, results holds all DeleteResults"""
+    def __init__(self, results):
+        self.results = results
+        failed = [result for result in results if result.error is not None]
+        super(BulkDeleteError, self).__init__(
+            "{} of {} deletions failed, first error: {}".format(len(failed), len(results), failed[0].error))
 
 
 class ZenobaseAPI:
@@ -8,18 +71,138 @@ class ZenobaseAPI:
 
     HOST = "https://api.zenobase.com"
 
-    def __init__(self, username=None, password=None):
-        payload = {}
+    def __init__(self, username=None, password=None, session=None, pool_size=10, timeout=(10, 60),
+                 bucket_cache_ttl=300, sync_state=None, dedup_store=None, retry=None, rate_limiter=None,
+                 json_dumps=None, stream_chunk_size=None, compress_threshold=None, compress_level=6,
+                 cache=None, token_store=None, revoke_on_close=None, host=None, observers=None):
+        """
+            session:   Transport used for all requests, anything with the interface of
+                       requests.Session will do. If not given a pooled keep-alive session
+                       is created and owned (and closed) by the client.
+            pool_size: Maximum number of kept-alive connections to the host.
+            timeout:   Passed to every request, either seconds or a (connect, read) tuple.
+            bucket_cache_ttl: Seconds before the label->bucket index used by
+                       create_or_get_bucket is rebuilt from the API.
+            sync_state: SyncState holding the high-water marks used by sync_events,
+                       by default they are only kept in memory.
+            dedup_store: DedupStore, if given create_event and create_events skip events
+                       whose content hash shows they have already been uploaded.
+            retry:     RetryPolicy for failed requests, RetryPolicy() by default. Pass
+                       RetryPolicy(max_retries=0) to disable retries.
+            rate_limiter: RateLimiter every request waits for, may be shared between clients.
+            json_dumps: JSON backend used to encode request data, a function returning str or
+                       bytes. Defaults to json.dumps (handling CompactZenobaseEvents). For a
+                       faster one install pyzenobase[orjson] and pass
+                       functools.partial(orjson.dumps, default=zenobase_event.json_default).
+            stream_chunk_size: create_events encodes and sends event bodies incrementally in
+                       chunks of about this many bytes, with chunked transfer encoding. Off
+                       (None) by default, as servers may reject requests without a
+                       Content-Length (411); bodies are then encoded fully first.
+            compress_threshold: Gzip compress request bodies of at least this many bytes
+                       (streamed bodies are always compressed). None disables compression.
+            compress_level: zlib compression level, 1 (fastest) to 9 (smallest).
+            cache:     ResponseCache (MemoryCache or DiskCache) for GET responses. Cached
+                       responses are revalidated with ETag/If-Modified-Since if the server
+                       sent those headers, and are dropped when the bucket is written to.
+            token_store: TokenStore to share access tokens between processes. A stored,
+                       unexpired token is reused instead of logging in, and a new one is
+                       fetched when it expires or is rejected with a 401. Tokens are
+                       stored by host, username and a hash of the password.
+            revoke_on_close: Whether close() revokes the access token. Defaults to True
+                       without a token_store and to False with one.
+            host:      URL of the API, such as that of a MockZenobaseServer. Defaults to HOST.
+            observers: Functions called with a RequestInfo (timings, sizes, status code and
+                       retries) after every request, such as a Metrics instance.
+        """
+        if host is not None:
+            self.HOST = host.rstrip("/")
+        self._owns_session = session is None
+        self.session = session if session is not None else self._create_session(pool_size)
+        self.timeout = timeout
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.json_dumps = json_dumps if json_dumps is not None else dumps
+        self.stream_chunk_size = stream_chunk_size
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self.cache = cache
+        self.observers = list(observers) if observers is not None else []
+
+        self.bucket_cache_ttl = bucket_cache_ttl
+        self._buckets_by_label = None
+        self._bucket_index_built_at = 0
+        self._bucket_index_lock = threading.RLock()
+        self.sync_state = sync_state if sync_state is not None else SyncState()
+        self.dedup_store = dedup_store
+
+        self.token_store = token_store
+        self.revoke_on_close = revoke_on_close if revoke_on_close is not None else token_store is None
         if username is not None:
-            payload = {"grant_type": "password", "username": username, "password": password}
+            self._auth_payload = {"grant_type": "password", "username": username, "password": password}
+            self._token_key = None
+            if token_store is not None:
+                self._token_key = "{} {} {}".format(self.HOST, username,
+                                                    token_store.credentials_key(username, password))
         else:
-            payload = {"grant_type": "client_credentials"}
-        r = requests.post(self.HOST + "/oauth/token", data=payload)
+            self._auth_payload = {"grant_type": "client_credentials"}
+            self._token_key = "{} client_credentials".format(self.HOST)
+        self.access_token = None
+        self._token_refresh_at = None
+        self._auth_lock = threading.Lock()
+        self._authenticate()
+
+    def _authenticate(self, rejected_token=None):
+        """
+            Sets the access token, reusing the one in the token store unless it has
+            expired or is rejected_token (which got a 401). The store is locked while
+            logging in so that other processes wait for and reuse the new token.
+        """
+        with self._auth_lock:
+            if self.access_token != rejected_token:
+                # Another thread has already replaced the token
+                return
+            if self.token_store is None:
+                self._set_token(self._fetch_token())
+                return
+            with self.token_store.lock():
+                token = self.token_store.get(self._token_key)
+                if token is None or token["access_token"] == rejected_token:
+                    token = self._fetch_token()
+                    self.token_store.set(self._token_key, token)
+            self._set_token(token)
+
+    def _fetch_token(self):
+        """Logs in, with the same retries, rate limiting and observers as other requests"""
+        return self._observed(RequestInfo("POST", "/oauth/token"), self._send_token)
+
+    def _send_token(self, info):
+        kwargs = {"data": self._auth_payload, "headers": {}, "timeout": self.timeout}
+        r = self._send_attempts("POST", self.HOST + "/oauth/token", kwargs, info, idempotent=True)
         data = r.json()
         if "error" in data:
             raise Exception("Invalid Zenobase credentials")
-        self.access_token = data["access_token"]
-        self.client_id = data["client_id"]
+        expires_in = data.get("expires_in")
+        if expires_in is None:
+            return {"access_token": data["access_token"], "client_id": data["client_id"],
+                    "expires_at": None, "refresh_at": None}
+        # Tokens shorter-lived than twice the margin are refreshed halfway instead of on every request
+        now = time.time()
+        return {"access_token": data["access_token"], "client_id": data["client_id"],
+                "expires_at": now + expires_in,
+                "refresh_at": now + expires_in - min(TokenStore.EXPIRY_MARGIN, expires_in / 2)}
+
+    def _set_token(self, token):
+        self.access_token = token["access_token"]
+        self.client_id = token["client_id"]
+        self._token_refresh_at = TokenStore.refresh_at(token)
+
+    @staticmethod
+    def _create_session(pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
 
     def __enter__(self):
         return self
@@ -27,58 +210,360 @@ class ZenobaseAPI:
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
 
-    def _request(self, method, endpoint, data=None, headers={}):
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def _request(self, method, endpoint, data=None, headers=None, body=None, events=None):
+        """
+            If body is given it is sent as-is instead of data, it should be encoded JSON or
+            an iterable of encoded chunks (which is sent with chunked transfer encoding).
+            events is the number of events sent, which is reported to the observers.
+        """
+        return self._observed(RequestInfo(method, endpoint, events), self._send, method, endpoint, data, headers, body)
+
+    def _observed(self, info, send, *args):
+        """Returns send(*args, info), passing info to the observers once it returns or raises"""
+        started = time.perf_counter()
+        try:
+            return send(*args, info)
+        except Exception as e:
+            info.error = e
+            raise
+        finally:
+            info.total_time = time.perf_counter() - started
+            for observer in self.observers:
+                observer(info)
+
+    def _send(self, method, endpoint, data, headers, body, info):
         url = self.HOST + endpoint
-        headers["Authorization"] = "Bearer {}".format(self.access_token)
+        token = self.access_token
+        if self._token_refresh_at is not None and self._token_refresh_at < time.time():
+            self._authenticate(rejected_token=token)
+            token = self.access_token
+        headers = dict(headers) if headers else {}
+        headers["Authorization"] = "Bearer {}".format(token)
         headers["Content-Type"] = "application/json"
-        args = [url]
-        kwargs = {"data": json.dumps(data), "headers": headers}
-        r = method(*args, **kwargs)
-        if not (200 <= r.status_code < 300):
-            raise Exception("Status code was not 2xx: {}".format(r))
+        headers.setdefault("Accept-Encoding", "gzip, deflate")
+
+        cached = None
+        if method == "GET" and self.cache is not None:
+            cached = self.cache.get(endpoint)
+            if cached is not None:
+                if self.cache.is_fresh(cached):
+                    info.cached = True
+                    # Counted as the 200 it stands in for, not as a failed request
+                    info.status_code = 200
+                    return self._cached_response(cached)
+                if cached["etag"] is not None:
+                    headers["If-None-Match"] = cached["etag"]
+                if cached["last_modified"] is not None:
+                    headers["If-Modified-Since"] = cached["last_modified"]
+
+        started = time.perf_counter()
+        body = self.json_dumps(data) if body is None else body
+        if self.compress_threshold is not None:
+            body = self._compress(body, headers)
+        info.encode_time = time.perf_counter() - started
+        if isinstance(body, (str, bytes)):
+            info.request_bytes = len(body)
+        else:
+            body = _CountingBody(body)
+        kwargs = {"data": body, "headers": headers, "timeout": self.timeout}
+        r = self._send_attempts(method, url, kwargs, info, cached, token=token)
+
+        if isinstance(body, _CountingBody):
+            info.request_bytes = body.bytes
+        info.response_bytes = len(r.content)
+        started = time.perf_counter()
+        try:
+            return self._handle_response(method, endpoint, r, cached)
+        finally:
+            info.decode_time = time.perf_counter() - started
+
+    def _send_attempts(self, method, url, kwargs, info, cached=None, idempotent=False, token=None):
+        """
+            Sends the request as many times as the retry policy allows and returns the first
+            2xx response (or 304, if there is a cached response). Requests carrying a token
+            are sent once more with a new token if they get a 401.
+        """
+        headers = kwargs["headers"]
+        attempt = 0
+        reauthenticated = token is None
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            info.attempts += 1
+            started = time.perf_counter()
+            try:
+                r = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                info.wait_time += time.perf_counter() - started
+                if not self.retry.should_retry(method, attempt, idempotent=idempotent):
+                    raise
+                self._backoff(info, self.retry.backoff(attempt))
+                attempt += 1
+                continue
+            info.wait_time += time.perf_counter() - started
+            info.status_code = r.status_code
+            if getattr(r, "elapsed", None) is not None:
+                info.server_time += r.elapsed.total_seconds()
+
+            if 200 <= r.status_code < 300 or (r.status_code == 304 and cached is not None):
+                return r
+            if r.status_code == 401 and not reauthenticated:
+                # The token expired or was revoked (perhaps by another process sharing it)
+                # Only the token this request was sent with is rejected, so that concurrent
+                # requests failing with the same token all reuse the first replacement
+                self._authenticate(rejected_token=token)
+                token = self.access_token
+                headers["Authorization"] = "Bearer {}".format(token)
+                reauthenticated = True
+                continue
+            if not self.retry.should_retry(method, attempt, r.status_code, idempotent=idempotent):
+                raise ZenobaseAPIError(r)
+            retry_after = RetryPolicy.parse_retry_after(r.headers.get("Retry-After"))
+            self._backoff(info, self.retry.backoff(attempt, retry_after))
+            attempt += 1
+
+    @staticmethod
+    def _backoff(info, seconds):
+        info.backoff_time += seconds
+        time.sleep(seconds)
+
+    def _handle_response(self, method, endpoint, r, cached):
+        """Updates the cache and decodes the response"""
+        if self.cache is not None:
+            if r.status_code == 304:
+                cached["stored_at"] = time.time()
+                self.cache.set(endpoint, cached)
+                return self._cached_response(cached)
+            if method == "GET":
+                self.cache.set(endpoint, {"content": r.text,
+                                          "is_json": "application/json" in r.headers.get("content-type", ""),
+                                          "etag": r.headers.get("ETag"),
+                                          "last_modified": r.headers.get("Last-Modified"),
+                                          "stored_at": time.time()})
+            else:
+                self._invalidate_cache(endpoint)
 
         if "content-type" in r.headers:
             if "application/json" in r.headers["content-type"]:
                 return r.json()
         return r.text
 
+    @staticmethod
+    def _cached_response(entry):
+        # Parsed anew on every hit so callers can't modify the cached response
+        return json.loads(entry["content"]) if entry["is_json"] else entry["content"]
+
+    def _invalidate_cache(self, endpoint):
+        """Drops cached responses that a write to endpoint may have changed"""
+        # Bucket listings include every bucket, so they are dropped by all writes
+        prefixes, keys = ["/users/"], []
+        match = _BUCKET_ENDPOINT_RE.match(endpoint)
+        if match is not None:
+            bucket = "/buckets/{}".format(match.group(1))
+            prefixes += [bucket + "/", bucket + "?"]
+            keys.append(bucket)
+        self.cache.invalidate(prefixes, keys)
+
+    def _compress(self, body, headers):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        if isinstance(body, bytes):
+            if len(body) < self.compress_threshold:
+                return body
+            body = gzip.compress(body, self.compress_level)
+        else:
+            body = GzipBody(body, self.compress_level)
+        headers["Content-Encoding"] = "gzip"
+        return body
+
     def _get(self, *args, **kwargs):
-        return self._request(requests.get, *args, **kwargs)
+        return self._request("GET", *args, **kwargs)
 
     def _post(self, *args, **kwargs):
-        return self._request(requests.post, *args, **kwargs)
+        return self._request("POST", *args, **kwargs)
 
     def _delete(self, *args, **kwargs):
-        return self._request(requests.delete, *args, **kwargs)
+        return self._request("DELETE", *args, **kwargs)
+
+    def _iter_bucket_pages(self, offset=0, limit=None, page_size=100):
+        while limit is None or limit > 0:
+            page_limit = page_size if limit is None else min(page_size, limit)
+            page = self._get("/users/{}/buckets/?order=label&offset={}&limit={}"
+                             .format(self.client_id, offset, page_limit))
+            yield page
+            offset += len(page["buckets"])
+            if limit is not None:
+                limit -= len(page["buckets"])
+            if len(page["buckets"]) < page_limit or offset >= page.get("total", offset + 1):
+                break
 
     def list_buckets(self, offset=0, limit=100):
-        """Limit breaks above 100"""
-        # TODO: If limit > 100, do multiple fetches
-        if limit > 100:
-            raise Exception("Zenobase can't handle limits over 100")
-        return self._get("/users/{}/buckets/?order=label&offset={}&limit={}".format(self.client_id, offset, limit))
+        """
+            Zenobase can't handle limits above 100, larger limits (or limit=None for all
+            buckets) are fetched in multiple pages and returned as a single response.
+        """
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be at least 1 (or None for all buckets)")
+        pages = self._iter_bucket_pages(offset, limit)
+        data = next(pages)
+        for page in pages:
+            data["buckets"].extend(page["buckets"])
+        return data
+
+    def iter_buckets(self, page_size=100):
+        """Yields all buckets ordered by label, fetching them page_size at a time"""
+        for page in self._iter_bucket_pages(page_size=page_size):
+            yield from page["buckets"]
 
     def get_bucket(self, bucket_id):
         return self._get("/buckets/{}".format(bucket_id))
 
+    def _bucket_index(self):
+        """Returns the label->bucket index, rebuilding it if it is older than bucket_cache_ttl"""
+        with self._bucket_index_lock:
+            if self._buckets_by_label is None or \
+                    time.monotonic() - self._bucket_index_built_at > self.bucket_cache_ttl:
+                buckets_by_label = {}
+                for bucket in self.iter_buckets():
+                    buckets_by_label.setdefault(bucket["label"], bucket)
+                self._buckets_by_label = buckets_by_label
+                self._bucket_index_built_at = time.monotonic()
+            return self._buckets_by_label
+
+    def invalidate_bucket_index(self):
+        with self._bucket_index_lock:
+            self._buckets_by_label = None
+
     def create_bucket(self, label, description=""):
         if not 1 <= len(label) <= 20:
             raise Exception("Bucket name must be 1-20 chars and can only contain [a-zA-Z0-9-_ ]")
-        return self._post("/buckets/", data={"label": label, "description": description})
+        bucket = self._post("/buckets/", data={"label": label, "description": description})
+        with self._bucket_index_lock:
+            if self._buckets_by_label is not None and isinstance(bucket, dict):
+                self._buckets_by_label.setdefault(bucket.get("label", label), bucket)
+        return bucket
 
     def create_or_get_bucket(self, label, description=""):
-        data = self.list_buckets()
-        for bucket in data["buckets"]:
-            if bucket["label"] == label:
-                return bucket
-        return self.create_bucket(label, description=description)
+        """Looks the label up in the bucket index, so repeated calls don't hit the network"""
+        with self._bucket_index_lock:
+            bucket = self._bucket_index().get(label)
+            if bucket is None:
+                bucket = self.create_bucket(label, description=description)
+            return bucket
 
     def delete_bucket(self, bucket_id):
         self._delete("/buckets/{}".format(bucket_id))
+        with self._bucket_index_lock:
+            if self._buckets_by_label is not None:
+                self._buckets_by_label = {label: bucket for label, bucket in self._buckets_by_label.items()
+                                          if bucket["@id"] != bucket_id}
+        self.sync_state.forget(bucket_id)
+        if self.dedup_store is not None:
+            self.dedup_store.forget(bucket_id)
+
+    def delete_buckets(self, buckets, max_workers=8, raise_on_error=True, progress=None):
+        """
+            Deletes many buckets (or bucket ids) concurrently, with at most max_workers
+            requests in flight. progress, if given, is called as progress(done, failed)
+            after every deletion.
+
+            Returns a list with one DeleteResult per bucket in input order. If any deletion
+            failed and raise_on_error is set, BulkDeleteError is raised once all are done.
+        """
+        bucket_ids = [self._bucket_id_from_bucket_or_id(bucket) for bucket in buckets]
+        return self._delete_all(self.delete_bucket, bucket_ids, max_workers, raise_on_error, progress)
+
+    def delete_event(self, bucket_or_bucket_id, event_id):
+        bucket_id = self._bucket_id_from_bucket_or_id(bucket_or_bucket_id)
+        return self._delete("/buckets/{}/{}".format(bucket_id, event_id))
+
+    def delete_events(self, bucket_or_bucket_id, event_ids=None, where=None, max_workers=8, raise_on_error=True,
+                      progress=None):
+        """
+            Deletes the events with the given @ids, or all events for which the predicate
+            where(event) is true, concurrently like delete_buckets. Matching events are all
+            found before any is deleted, since deleting shifts the pages of iter_events.
+
+            Deleted events are not removed from the dedup store, so identical events will
+            still be skipped by create_events.
+        """
+        if (event_ids is None) == (where is None):
+            raise ValueError("Exactly one of event_ids and where must be given")
+        bucket_id = self._bucket_id_from_bucket_or_id(bucket_or_bucket_id)
+        if event_ids is None:
+            event_ids = [event["@id"] for event in self.iter_events(bucket_id) if where(event)]
+
+        def delete(event_id):
+            return self.delete_event(bucket_id, event_id)
+
+        return self._delete_all(delete, list(event_ids), max_workers, raise_on_error, progress)
+
+    @staticmethod
+    def _delete_all(delete, ids, max_workers, raise_on_error, progress):
+        errors = {}
+        done = 0
+        for item_id, _, error in bounded_map(delete, ids, max_workers=max_workers):
+            done += 1
+            if error is not None:
+                errors[item_id] = error
+            if progress is not None:
+                progress(done, len(errors))
+
+        results = [DeleteResult(item_id, errors.get(item_id)) for item_id in ids]
+        if raise_on_error and errors:
+            raise BulkDeleteError(results)
+        return results
 
     def list_events(self, bucket_id):
         return self._get("/buckets/{}/".format(bucket_id))
 
+    def iter_events(self, bucket_or_bucket_id, page_size=100, prefetch=1, order="timestamp", q=None):
+        """
+            Yields the events in a bucket one at a time, fetching them page_size at a time
+            using offset/limit. While a page is being consumed the next prefetch pages are
+            fetched in the background, so memory use only depends on page_size and prefetch.
+            q is a Zenobase query the server filters the events with, such as "tag:coffee".
+        """
+        bucket_id = self._bucket_id_from_bucket_or_id(bucket_or_bucket_id)
+        endpoint = "/buckets/{}/?{}order={}&offset={{}}&limit={}".format(bucket_id, self._query_param(q),
+                                                                        order, page_size)
+
+        def fetch(offset):
+            return self._get(endpoint.format(offset))
+
+        page = fetch(0)
+        total = page.get("total")
+        offsets = count(page_size, page_size) if total is None else iter(range(page_size, total, page_size))
+        with ThreadPoolExecutor(max_workers=max(prefetch, 1)) as executor:
+            pending = deque()
+            try:
+                while True:
+                    events = page["events"]
+                    for offset in islice(offsets, prefetch - len(pending)):
+                        pending.append(executor.submit(fetch, offset))
+                    yield from events
+
+                    if len(events) < page_size:
+                        break
+                    if pending:
+                        page = pending.popleft().result()
+                    else:
+                        offset = next(offsets, None)
+                        if offset is None:
+                            break
+                        page = fetch(offset)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    @staticmethod
+    def _query_param(q):
+        """The q=...& part of an events URL, empty if q is None"""
+        return "q={}&".format(quote(q, safe="")) if q is not None else ""
+
     @staticmethod
     def _bucket_id_from_bucket_or_id(bucket_or_bucket_id):
         assert isinstance(bucket_or_bucket_id, str) or isinstance(bucket_or_bucket_id, dict)
@@ -92,16 +577,163 @@ class ZenobaseAPI:
         return bucket_id
 
     def create_event(self, bucket_or_bucket_id, event):
-        assert isinstance(event, ZenobaseEvent) or isinstance(event, dict)
+        """Returns None without uploading if dedup_store shows the event has already been uploaded"""
+        assert isinstance(event, dict) or isinstance(event, CompactZenobaseEvent)
         bucket_id = self._bucket_id_from_bucket_or_id(bucket_or_bucket_id)
-        return self._post("/buckets/{}/".format(bucket_id), data=event)
+        if self.dedup_store is None:
+            return self._post("/buckets/{}/".format(bucket_id), data=event, events=1)
+
+        dedup_index, h = self.dedup_store.index(bucket_id), event_hash(event)
+        if h in dedup_index:
+            return None
+        response = self._post("/buckets/{}/".format(bucket_id), data=event, events=1)
+        dedup_index.add_all([h])
+        return response
 
-    def create_events(self, bucket_or_bucket_id, events):
-        assert isinstance(events, list)
+    def create_events(self, bucket_or_bucket_id, events, batch_size=1000, max_bytes=None, max_workers=4,
+                      raise_on_error=True, journal=None, source=None, offset=0):
+        """
+            Uploads any iterable of events in batches of at most batch_size events and,
+            if given, max_bytes bytes of JSON. Up to max_workers batches are uploaded
+            concurrently, the next batch is sent as soon as any one of them completes.
+
+            Returns a list with one BatchResult per batch in input order. If a batch failed
+            and raise_on_error is set, BatchUploadError is raised once all batches are done.
+
+            With a dedup_store, events that have already been uploaded (or occur earlier in
+            events) are skipped and the events of each successful batch are recorded.
+
+            With an UploadJournal, every acknowledged batch is recorded under the bucket and
+            source (a name for the input) and events already recorded are skipped without
+            being encoded or sent, so an interrupted upload is resumed by running it again.
+            offset is the position in the source of the first event in events, for readers
+            that skip the first journal.resume_offset(bucket_id, source) events themselves.
+        """
         bucket_id = self._bucket_id_from_bucket_or_id(bucket_or_bucket_id)
-        for event in events:
-            assert isinstance(event, ZenobaseEvent) or isinstance(event, dict)
-        return self._post("/buckets/"+bucket_id+"/", data={"events": events})
+        endpoint = "/buckets/"+bucket_id+"/"
+        dedup_index = self.dedup_store.index(bucket_id) if self.dedup_store is not None else None
+        if journal is not None and source is None:
+            raise ValueError("A source is required to keep an upload journal")
+        completed = journal.completed(bucket_id, source) if journal is not None else []
 
-    def close(self):
+        def prepare(events):
+            seen, i = set(), 0
+            for position, event in enumerate(events, offset):
+                assert isinstance(event, dict) or isinstance(event, CompactZenobaseEvent)
+                while i < len(completed) and completed[i][1] <= position:
+                    i += 1
+                if i < len(completed) and completed[i][0] <= position:
+                    continue
+                # Events only need to be encoded up front to know the size of a batch,
+                # otherwise they're encoded while the request body is being sent.
+                payload = self.json_dumps(event) if max_bytes is not None else event
+                if dedup_index is None:
+                    yield position, payload, None
+                    continue
+                h = event_hash(event)
+                if h not in seen and h not in dedup_index:
+                    seen.add(h)
+                    yield position, payload, h
+
+        def with_ranges(batches):
+            # Each batch covers the positions from the end of the previous batch, so that
+            # skipped events between batches are also part of the recorded ranges.
+            start = offset
+            for index, batch in enumerate(batches):
+                end = batch[-1][0] + 1
+                yield index, start, end, batch
+                start = end
+
+        def upload(batch_with_range):
+            _, start, end, batch = batch_with_range
+            body = EventsBody([payload for _, payload, _ in batch],
+                              dumps=self.json_dumps if max_bytes is None else None,
+                              chunk_size=self.stream_chunk_size or 65536)
+            if self.stream_chunk_size is None:
+                body = body.to_bytes()
+            response = self._post(endpoint, body=body, events=len(batch))
+            if dedup_index is not None:
+                dedup_index.add_all(h for _, _, h in batch)
+            if journal is not None:
+                journal.record(bucket_id, source, start, end)
+            return response
+
+        if max_bytes is not None:
+            max_bytes -= len(EVENTS_PREFIX) + len(EVENTS_SUFFIX)
+        # Each encoded event is followed by a separator in the request body
+        batches = iter_batches(prepare(events), batch_size=batch_size, max_bytes=max_bytes,
+                               size=lambda item: len(item[1]) + len(EVENTS_SEPARATOR))
+        results = []
+        for (index, _, _, batch), response, error in bounded_map(upload, with_ranges(batches),
+                                                                 max_workers=max_workers):
+            results.append(BatchResult(index, len(batch), response, error))
+        results.sort(key=lambda result: result.index)
+
+        if raise_on_error and any(result.error is not None for result in results):
+            raise BatchUploadError(results)
+        return results
+
+    @staticmethod
+    def _latest_timestamp(event):
+        timestamps = event["timestamp"] if isinstance(event["timestamp"], list) else [event["timestamp"]]
+        return max(parse_datetime(fmt_datetime(ts) if isinstance(ts, datetime) else ts) for ts in timestamps)
+
+    def get_latest_timestamp(self, bucket_or_bucket_id, tag=None):
+        """
+            Returns the latest timestamp of any event in the bucket (tagged with tag, if
+            given) as an aware datetime, None if there is none
+        """
+        bucket_id = self._bucket_id_from_bucket_or_id(bucket_or_bucket_id)
+        query = self._query_param("tag:{}".format(tag) if tag is not None else None)
+        events = self._get("/buckets/{}/?{}order=-timestamp&offset=0&limit=1".format(bucket_id, query))["events"]
+        return self._latest_timestamp(events[0]) if events else None
+
+    def sync_events(self, bucket_or_bucket_id, events, tag=None, **kwargs):
+        """
+            Uploads only the events that are newer than the bucket's high-water mark,
+            the latest timestamp already in the bucket. The mark is fetched from the API
+            the first time a bucket is synced, after that it is kept in sync_state and
+            advanced after every fully successful sync.
+
+            If several sources upload to the same bucket give each its own tag (which
+            all of its events must carry), the events tagged with it then have a
+            high-water mark of their own, fetched with a tag query.
+
+            All events need a timestamp. Takes the same keyword arguments as create_events
+            and returns its results.
+        """
+        bucket_id = self._bucket_id_from_bucket_or_id(bucket_or_bucket_id)
+        key = bucket_id if tag is None else "{} {}".format(bucket_id, tag)
+        mark = self.sync_state.get(key)
+        if mark is None:
+            mark = self.get_latest_timestamp(bucket_id, tag=tag)
+        newest = [mark]
+
+        def newer(events):
+            for event in events:
+                if "timestamp" not in event:
+                    raise ValueError("sync_events requires every event to have a timestamp")
+                timestamp = self._latest_timestamp(event)
+                if mark is None or timestamp > mark:
+                    if newest[0] is None or timestamp > newest[0]:
+                        newest[0] = timestamp
+                    yield event
+
+        results = self.create_events(bucket_id, newer(events), **kwargs)
+        if newest[0] is not None and all(result.error is None for result in results):
+            self.sync_state.set(key, newest[0])
+        return results
+
+    def revoke(self):
+        """Revokes the access token, also for other processes sharing it through the token store"""
+        if self.token_store is not None:
+            self.token_store.forget(self._token_key)
         return self._delete("/authorizations/"+self.access_token)
+
+    def close(self):
+        try:
+            if self.revoke_on_close:
+                return self.revoke()
+        finally:
+            if self._owns_session:
+                self.session.close()
@@ -1,32 +1,47 @@
 from datetime import datetime
+from collections.abc import Mapping
 from pyzenobase import fmt_datetime
 
-_VALID_FIELDS = ["bits", "concentration", "count", "currency", "distance",
+_VALID_FIELDS = frozenset(["bits", "concentration", "count", "currency", "distance",
                  "distance/volume", "duration", "energy", "frequency", "height",
                  "humidity", "location", "moon", "note", "pace", "percentage",
                  "pressure", "rating", "resource", "sound", "source", "tag",
-                 "temperature", "timestamp", "velocity", "volume", "weight"]
+                 "temperature", "timestamp", "velocity", "volume", "weight"])
+
+
+def normalize_unit(field, unit):
+    """Returns the unit as Zenobase wants it for the given field"""
+    if field == "volume":
+        return unit.replace("l", "L")
+    # Zenobase uses "ug" for micrograms
+    if field == "weight" and unit in ("mcg", "µg"):
+        return "ug"
+    return unit
 
 
 class ZenobaseEvent(dict):
     """
         Provides simple structure checking
     """
-    def __init__(self, data):
-        super(ZenobaseEvent, self).__init__(self)
-        for field in data:
-            assert field in _VALID_FIELDS
-            self[field] = data[field]
+    def __init__(self, data, trusted=False):
+        """
+            trusted: Skip checking field names and timestamp types, for data that is
+                     already known to be valid (such as events fetched from Zenobase).
+        """
+        super(ZenobaseEvent, self).__init__(data)
+        if not trusted:
+            assert _VALID_FIELDS.issuperset(self), "Invalid fields: {}".format(set(self) - _VALID_FIELDS)
 
-        self.clean_data()
+        self.clean_data(trusted=trusted)
 
-    def clean_data(self):
+    def clean_data(self, trusted=False):
         """Ensures data is Zenobase compatible and patches it if possible,
         if cleaning is not possible it'll raise an appropriate exception"""
 
         # TODO: Do the same for duration/timedelta
         if "timestamp" in self:
-            self._check_timestamp()
+            if not trusted:
+                self._check_timestamp()
             if type(self["timestamp"]) == list:
                 def datetime_to_string(dt):
                     return fmt_datetime(dt) if type(dt) == datetime else dt
@@ -36,16 +51,60 @@ class ZenobaseEvent(dict):
 
         # FIXME: Support list of volumes
         if "volume" in self:
-            self["volume"]["unit"] = self["volume"]["unit"].replace("l", "L")
+            self["volume"]["unit"] = normalize_unit("volume", self["volume"]["unit"])
 
         # FIXME: Support list of weights
         if "weight" in self:
-            # Zenobase uses "ug" for micrograms
-            if self["weight"]["unit"] in ["mcg", "µg"]:
-                self["weight"]["unit"] = "ug"
+            self["weight"]["unit"] = normalize_unit("weight", self["weight"]["unit"])
 
     def _check_timestamp(self):
         if not type(self["timestamp"]) in (str, datetime, list) and \
                 (type(self["timestamp"]) != list or all(map(lambda x: type(x) in (str, datetime), self["timestamp"]))):
             raise TypeError("timestamp must be string, datetime or list of strings/datetimes")
 
+
+class CompactZenobaseEvent(Mapping):
+    """
+        Read-only, memory-efficient alternative to ZenobaseEvent for holding large numbers
+        of events. Values are kept in a tuple and the tuple of field names is shared by all
+        events with the same fields, instead of every event having its own dict.
+
+        Events are validated and cleaned exactly like ZenobaseEvent and serialise to the
+        same JSON (json.dumps needs default=json_default, ZenobaseAPI handles this).
+    """
+
+    __slots__ = ("_fields", "_values")
+
+    _shared_fields = {}
+
+    def __init__(self, data, trusted=False):
+        if not isinstance(data, ZenobaseEvent):
+            data = ZenobaseEvent(data, trusted=trusted)
+        fields = tuple(data)
+        self._fields = self._shared_fields.setdefault(fields, fields)
+        self._values = tuple(data.values())
+
+    def __getitem__(self, field):
+        try:
+            return self._values[self._fields.index(field)]
+        except ValueError:
+            raise KeyError(field)
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return "CompactZenobaseEvent({!r})".format(self.to_dict())
+
+    def to_dict(self):
+        return dict(zip(self._fields, self._values))
+
+
+def json_default(obj):
+    """default for json.dumps that serialises CompactZenobaseEvents like ZenobaseEvents"""
+    if isinstance(obj, CompactZenobaseEvent):
+        return obj.to_dict()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
@@ -42,9 +42,12 @@ setup(
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.2',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
 
     # What does your project relate to?
@@ -54,9 +57,20 @@ setup(
     # simple. Or you can use find_packages().
     packages=["pyzenobase"],
 
+    # Lazy imports (module __getattr__), ThreadingHTTPServer, datetime.fromisoformat and
+    # asyncio.run all need 3.7
+    python_requires='>=3.7',
+
     # List run-time dependencies here.  These will be installed by pip when your
     # project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/technical.html#install-requires-vs-requirements-files
-    install_requires=['pytz','requests', 'tzlocal']
+    install_requires=['pytz','requests', 'tzlocal'],
+
+    # Optional dependencies, installed with `pip install pyzenobase[async]`
+    extras_require={
+        'async': ['aiohttp'],
+        'numpy': ['numpy'],
+        'orjson': ['orjson'],
+    }
 )